@@ -0,0 +1,147 @@
+"""ASGI entry point: the same routes, with generation jobs and mail on one event loop.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:application --host 0.0.0.0 --port 3000
+
+Background jobs await the async OpenAI client and outgoing mail goes through
+aiosmtplib, so a waiting completion or SMTP session holds a task instead of a
+thread. The Flask routes are short (bcrypt already runs on the process pool)
+and are served through a2wsgi's WSGI adapter on a bounded thread pool
+(ASGI_WSGI_WORKERS), while the long-lived /get-meal-plan/stream connections
+are handled natively here.
+"""
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+# Must be set before main is imported: it picks the job handler and outbox class
+os.environ['EXECUTION_MODE'] = 'async'
+
+from a2wsgi import WSGIMiddleware  # noqa: E402
+
+import main  # noqa: E402
+from error_handler import ROUTE_SECONDS  # noqa: E402
+from plan_stream import format_sse  # noqa: E402
+
+# Jobs (e.g. new family generations) allowed in flight at once on the event loop
+ASYNC_JOB_CONCURRENCY = int(os.getenv('ASYNC_JOB_CONCURRENCY', '200'))
+# Threads serving the Flask routes
+ASGI_WSGI_WORKERS = int(os.getenv('ASGI_WSGI_WORKERS', '16'))
+
+wsgi_application = WSGIMiddleware(main.app, workers=ASGI_WSGI_WORKERS)
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode('ascii')),
+                            (b"access-control-allow-origin", b"*")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_meal_plan(scope, receive, send):
+    """Async /get-meal-plan/stream: same events as the Flask route, without holding a thread per client."""
+    started = time.perf_counter()
+    family_id = parse_qs(scope.get("query_string", b"").decode('utf-8')).get('family_id', [None])[0]
+
+    if family_id is None:
+        await send_json(send, 400, {"error": "family_id is required."})
+        return
+    if not main.is_family_id(family_id):
+        await send_json(send, 400, {"error": "family_id is not a valid family ID."})
+        return
+
+    file_path = os.path.join('meal_plans', family_id, '1.json')
+    loop = asyncio.get_running_loop()
+    # Subscribe before reading the file so no day can slip between the two
+    subscriber = main.plan_stream_broker.subscribe(family_id, loop=loop)
+    generating = main.is_generating(await asyncio.to_thread(main.generation_job, family_id))
+    disconnected = loop.create_task(wait_for_disconnect(receive))
+
+    try:
+        if not generating and not await asyncio.to_thread(os.path.exists, file_path):
+            await send_json(send, 404, {"error": "Meal plan not found for the given family ID."})
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                (b"cache-control", b"no-cache"),
+                                (b"x-accel-buffering", b"no"),
+                                (b"access-control-allow-origin", b"*")]})
+        ROUTE_SECONDS.labels('/get-meal-plan/stream', 'GET', 200).observe(time.perf_counter() - started)
+
+        async def write(messages):
+            if messages:
+                await send({"type": "http.response.body",
+                            "body": "".join(messages).encode('utf-8'), "more_body": True})
+
+        session = main.PlanEventStream(family_id, file_path)
+        await write(await asyncio.to_thread(session.saved_days))
+        if not generating:
+            await write([format_sse("done", {"family_id": family_id})])
+        else:
+            last_sent = time.monotonic()
+            while not disconnected.done():
+                try:
+                    event, data = await subscriber.get(timeout=main.STREAM_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    # Reads 1.json and jobs.db, keep that off the loop
+                    messages, finished = await asyncio.to_thread(session.poll)
+                else:
+                    if event == "done":
+                        # handle() re-reads the saved plan on "done", keep that off the loop
+                        messages, finished = await asyncio.to_thread(session.handle, event, data)
+                    else:
+                        messages, finished = session.handle(event, data)
+                if messages:
+                    last_sent = time.monotonic()
+                    await write(messages)
+                elif time.monotonic() - last_sent >= 15:
+                    last_sent = time.monotonic()
+                    await write([": keepalive\n\n"])
+                if finished:
+                    break
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnected.cancel()
+        main.plan_stream_broker.unsubscribe(family_id, subscriber)
+
+
+async def lifespan(receive, send):
+    job_runner = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            loop = asyncio.get_running_loop()
+            main.outbox.bind(loop)
+            # Only the scheduler starts here; the job queue is drained on this loop instead
+            main.start_background_services()
+            job_runner = loop.create_task(main.job_queue.run_async(ASYNC_JOB_CONCURRENCY))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if job_runner is not None:
+                # Jobs still running are re-queued on the next start
+                job_runner.cancel()
+            await asyncio.to_thread(main.meal_plan_scheduler.stop, 5)
+            await main.outbox.aclose()
+            main.password_hasher.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif (scope["type"] == "http" and scope["path"] == "/get-meal-plan/stream"
+          and scope["method"] == "GET"):
+        await stream_meal_plan(scope, receive, send)
+    else:
+        await wsgi_application(scope, receive, send)
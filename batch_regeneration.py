@@ -0,0 +1,298 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import suppress
+from itertools import chain, islice
+
+COMPLETION_ENDPOINT = "/v1/chat/completions"
+# Terminal states of an OpenAI batch; "expired" and "cancelled" can still carry partial output
+FINISHED_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def batch_request_line(custom_id, body):
+    return json.dumps({"custom_id": custom_id, "method": "POST",
+                       "url": COMPLETION_ENDPOINT, "body": body})
+
+
+def iter_jsonl(path):
+    """Yields one parsed object per line, reading the file lazily."""
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def completion_from_result(result):
+    """Returns (content, error) for one line of a batch output or error file."""
+    if result.get("error"):
+        return None, result["error"].get("message") or str(result["error"])
+    response = result.get("response") or {}
+    if response.get("status_code") != 200:
+        return None, f"HTTP {response.get('status_code')}: {json.dumps(response.get('body'))[:200]}"
+    try:
+        return response["body"]["choices"][0]["message"]["content"], None
+    except (KeyError, IndexError, TypeError):
+        return None, "Malformed batch response body"
+
+
+# Base interface shared by every batch backend
+class BatchBackend:
+    def submit(self, input_path):
+        """Submits a JSONL request file and returns the batch id."""
+        raise NotImplementedError
+
+    def status(self, batch_id):
+        """Returns {"status", "output_file_id", "error_file_id"} for a batch."""
+        raise NotImplementedError
+
+    def download(self, file_id, destination):
+        """Streams a result file to a local path."""
+        raise NotImplementedError
+
+    def discard(self, batch_id):
+        """Removes whatever the backend keeps on disk for a processed batch."""
+
+
+# Production backend: the OpenAI Batch API (cheaper, completes within 24 hours)
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path):
+        with open(input_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id,
+                                           endpoint=COMPLETION_ENDPOINT,
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        return {"status": batch.status, "output_file_id": batch.output_file_id,
+                "error_file_id": batch.error_file_id}
+
+    def download(self, file_id, destination):
+        with (self.client.files.with_streaming_response.content(file_id) as response,
+              open(destination, 'wb') as f):
+            for chunk in response.iter_bytes():
+                f.write(chunk)
+
+
+# Test backend: runs each request line through complete(body) on a local thread pool
+# and writes the results in the same format as the OpenAI Batch API
+class LocalBatchBackend(BatchBackend):
+    def __init__(self, complete, folder='data/batches/local', max_workers=4):
+        self.complete = complete
+        self.folder = folder
+        self.max_workers = max_workers
+        self._running = set()
+        self._lock = threading.Lock()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def _status_path(self, batch_id):
+        return os.path.join(self.folder, f"{batch_id}.json")
+
+    def _write_status(self, batch_id, status):
+        path = self._status_path(batch_id)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(status, f)
+        os.replace(f"{path}.tmp", path)
+
+    def submit(self, input_path):
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        self._write_status(batch_id, {"status": "in_progress", "output_file_id": None,
+                                      "error_file_id": None})
+        with self._lock:
+            self._running.add(batch_id)
+        threading.Thread(target=self._process, args=(batch_id, input_path), daemon=True).start()
+        return batch_id
+
+    def _run_request(self, request):
+        try:
+            content = self.complete(request["body"])
+        except Exception as e:
+            return {"id": uuid.uuid4().hex, "custom_id": request["custom_id"], "response": None,
+                    "error": {"code": "local_error", "message": str(e)}}
+        return {"id": uuid.uuid4().hex, "custom_id": request["custom_id"], "error": None,
+                "response": {"status_code": 200, "body": {
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}]}}}
+
+    def _result_paths(self, batch_id):
+        return (os.path.join(self.folder, f"{batch_id}_output.jsonl"),
+                os.path.join(self.folder, f"{batch_id}_errors.jsonl"))
+
+    def _process(self, batch_id, input_path):
+        output_path, error_path = self._result_paths(batch_id)
+        errors = 0
+        try:
+            with open(output_path, 'w') as output, open(error_path, 'w') as error_output:
+                def write(result):
+                    nonlocal errors
+                    if result["error"]:
+                        errors += 1
+                        error_output.write(json.dumps(result) + "\n")
+                    else:
+                        output.write(json.dumps(result) + "\n")
+
+                # Keep only max_workers requests in memory, however large the input file is
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    pending = set()
+                    for request in iter_jsonl(input_path):
+                        if len(pending) >= self.max_workers:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                write(future.result())
+                        pending.add(executor.submit(self._run_request, request))
+                    for future in pending:
+                        write(future.result())
+            self._write_status(batch_id, {"status": "completed", "output_file_id": output_path,
+                                          "error_file_id": error_path if errors else None})
+        except Exception as e:
+            logging.error(f"Local batch {batch_id} failed: {e}")
+            self._write_status(batch_id, {"status": "failed", "output_file_id": None,
+                                          "error_file_id": None})
+        finally:
+            with self._lock:
+                self._running.discard(batch_id)
+
+    def status(self, batch_id):
+        with self._lock:
+            running = batch_id in self._running
+        try:
+            with open(self._status_path(batch_id), 'r') as f:
+                status = json.load(f)
+        except FileNotFoundError:
+            return {"status": "failed", "output_file_id": None, "error_file_id": None}
+        if status["status"] == "in_progress" and not running:
+            # The process working on it exited; nothing will finish this batch
+            status["status"] = "expired"
+        return status
+
+    def download(self, file_id, destination):
+        shutil.copyfile(file_id, destination)
+
+    def discard(self, batch_id):
+        for path in (self._status_path(batch_id), *self._result_paths(batch_id)):
+            with suppress(FileNotFoundError):
+                os.remove(path)
+
+
+# Writes, submits and collects one run's batches, keeping a manifest so a restarted
+# process resumes polling instead of paying for the same requests twice
+class BatchRun:
+    def __init__(self, backend, folder, max_requests_per_batch=50000, poll_interval=60):
+        self.backend = backend
+        self.folder = folder
+        self.max_requests_per_batch = max_requests_per_batch
+        self.poll_interval = poll_interval
+        self.manifest_path = os.path.join(folder, "manifest.json")
+        self.manifest = None
+        self.stopped = False
+        self.missing = 0
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save_manifest(self, manifest):
+        with open(f"{self.manifest_path}.tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def write_inputs(self, requests):
+        """Streams (custom_id, body) pairs into JSONL files of at most max_requests_per_batch lines."""
+        batches = []
+        requests = iter(requests)
+        # Each pass of the outer loop starts a file and fills it from the same iterator
+        for first in requests:
+            batch = {"input": os.path.join(self.folder, f"input_{len(batches) + 1}.jsonl"),
+                     "requests": 0, "batch_id": None, "processed": False}
+            with open(batch["input"], 'w') as output:
+                for custom_id, body in chain([first], islice(requests, self.max_requests_per_batch - 1)):
+                    output.write(batch_request_line(custom_id, body) + "\n")
+                    batch["requests"] += 1
+            batches.append(batch)
+        return {"batches": batches}
+
+    def batches(self, requests, should_stop=None):
+        """Yields (batch, results) for each batch not yet processed, submitting and polling as needed.
+
+        `results` yields (custom_id, content, error) for the batch's requests.
+        Call mark_processed(batch) once all of them have been applied; a batch
+        that is never marked is downloaded again by a later call. `requests` is
+        only consumed when the run has no manifest yet. When should_stop() turns
+        true, polling ends with self.stopped set and the manifest left for a
+        later call. Requests a finished batch returned no line for are counted
+        in self.missing.
+        """
+        self.stopped = False
+        self.missing = 0
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.manifest = self._load_manifest()
+        if self.manifest is None:
+            self.manifest = self.write_inputs(requests)
+            self._save_manifest(self.manifest)
+
+        for batch in self.manifest["batches"]:
+            if batch["batch_id"] is None:
+                batch["batch_id"] = self.backend.submit(batch["input"])
+                self._save_manifest(self.manifest)
+                print(f"Submitted batch {batch['batch_id']} with {batch['requests']} requests")
+
+        for batch in self.manifest["batches"]:
+            if batch["processed"]:
+                continue
+            status = self._wait(batch["batch_id"], should_stop)
+            if status is None:
+                self.stopped = True
+                return
+            if status["status"] != "completed":
+                logging.error(f"Batch {batch['batch_id']} ended as {status['status']}")
+            yield batch, self._batch_results(batch, status)
+
+    def _batch_results(self, batch, status):
+        returned = 0
+        for field in ("output_file_id", "error_file_id"):
+            if not status.get(field):
+                continue
+            local_path = os.path.join(self.folder, f"{batch['batch_id']}_{field}.jsonl")
+            self.backend.download(status[field], local_path)
+            for result in iter_jsonl(local_path):
+                returned += 1
+                content, error = completion_from_result(result)
+                yield result.get("custom_id"), content, error
+            os.remove(local_path)
+
+        if returned < batch["requests"]:
+            self.missing += batch["requests"] - returned
+            logging.error(f"Batch {batch['batch_id']} returned {returned} of {batch['requests']} results")
+
+    def mark_processed(self, batch):
+        """Records a batch as applied and deletes its JSONL input and result files."""
+        batch["processed"] = True
+        self._save_manifest(self.manifest)
+        with suppress(FileNotFoundError):
+            os.remove(batch["input"])
+        self.backend.discard(batch["batch_id"])
+
+    def _wait(self, batch_id, should_stop):
+        while True:
+            status = self.backend.status(batch_id)
+            if status["status"] in FINISHED_STATES:
+                return status
+            if should_stop is not None and should_stop():
+                return None
+            time.sleep(self.poll_interval)
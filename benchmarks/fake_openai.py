@@ -0,0 +1,144 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Answers POST /v1/chat/completions with a well-formed meal plan for whatever
+emails (or single member) the prompt asks about, after a configurable delay,
+optionally streamed as Server-Sent Events chunk by chunk.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMAIL_KEY_PATTERN = re.compile(r'"([^"\s]+@[^"\s]+)": \[')
+DAY_PATTERN = re.compile(r'"day": (\d+)')
+
+
+def fake_meal_plan(prompt):
+    """Builds a plausible completion for a family prompt ({email: [...]}) or a member prompt ([...])."""
+    # Member prompts may ask for only some days (plan repairs)
+    requested_days = sorted({int(day) for day in DAY_PATTERN.findall(prompt)}) or range(1, 8)
+
+    def days(label):
+        return [{"day": day, "breakfast": f"{label} breakfast {day}",
+                 "lunch": f"{label} lunch {day}", "dinner": f"{label} dinner {day}"}
+                for day in requested_days]
+
+    emails = list(dict.fromkeys(EMAIL_KEY_PATTERN.findall(prompt)))
+    if emails:
+        return json.dumps({email: days(f"Member {i}") for i, email in enumerate(emails, start=1)},
+                          indent=2)
+    return json.dumps(days("Member"), indent=2)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.5, chunk_delay=0.005, chunk_size=16):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count_request()
+
+        prompt = payload.get("messages", [{}])[-1].get("content", "")
+        completion = fake_meal_plan(prompt)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(completion) // 4
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = payload.get("model", "gpt-3.5-turbo")
+
+        time.sleep(self.server.latency)
+
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if payload.get("stream"):
+            include_usage = (payload.get("stream_options") or {}).get("include_usage")
+            self._stream(completion_id, model, completion, usage if include_usage else None)
+            return
+
+        body = json.dumps({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": completion}}],
+            "usage": usage,
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, completion_id, model, completion, usage=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(delta, finish_reason=None, chunk_usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk",
+                     "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if chunk_usage is not None:
+                # Like the real API, the usage arrives on a final chunk with no choices
+                chunk["choices"] = []
+                chunk["usage"] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send({"role": "assistant", "content": ""})
+        size = self.server.chunk_size
+        for start in range(0, len(completion), size):
+            send({"content": completion[start:start + size]})
+            time.sleep(self.server.chunk_delay)
+        send({}, "stop")
+        if usage is not None:
+            send({}, chunk_usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="seconds between streamed chunks")
+    args = parser.parse_args()
+    server = FakeOpenAIServer((args.host, args.port), args.latency, args.chunk_delay)
+    print(f"Fake OpenAI API listening on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,275 @@
+"""Load test for the meal planner API against local OpenAI and SMTP stand-ins.
+
+Starts the Flask app from main.py in-process on a scratch working directory,
+drives /webhook, /login, /get-meal-plan and a full update_meal_plan run over
+N synthetic families, and prints a machine-readable JSON report (including a
+per-stage summary scraped from /metrics):
+
+    python benchmarks/run_benchmarks.py --families 50 --concurrency 8 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from smtp_sink import SMTPSink  # noqa: E402
+
+RESTRICTIONS = ["nuts", "vegan", "keto", "", "gluten", "vegetarian, nuts", "dairy", "sesame"]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies, statuses, elapsed):
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if status >= 500 or status == 0),
+        "status_counts": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "elapsed_seconds": round(elapsed, 3),
+    }
+
+
+def request(base_url, method, path, body=None, headers=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method, headers=headers or {})
+    if data is not None:
+        req.add_header("Content-Type", "application/json")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            payload = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        status = e.code
+    except OSError:
+        payload = b""
+        status = 0
+    return time.perf_counter() - started, status, payload
+
+
+def drive(base_url, calls, concurrency):
+    """Runs (method, path, body) calls with a fixed number of concurrent clients."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda call: request(base_url, *call), calls))
+    elapsed = time.perf_counter() - started
+    return results, summarize([r[0] for r in results], [r[1] for r in results], elapsed)
+
+
+def synthetic_family(n):
+    family = {"timestampt": time.strftime("%m/%d/%Y %H:%M:%S")}
+    for i in range(1, 5):
+        family[f"email_{i}"] = f"bench{n}_{i}@example.com"
+        family[f"first_name_{i}"] = f"Member{i}"
+        family[f"last_name_{i}"] = f"Family{n}"
+        family[f"dietary_restrictions_{i}"] = RESTRICTIONS[(n + i) % len(RESTRICTIONS)]
+    return family
+
+
+def wait_for_jobs(base_url, job_ids, timeout):
+    deadline = time.monotonic() + timeout
+    pending = set(job_ids)
+    failed = 0
+    while pending and time.monotonic() < deadline:
+        for job_id in list(pending):
+            _, status, payload = request(base_url, "GET", f"/jobs/{job_id}")
+            if status == 200:
+                state = json.loads(payload)["status"]
+                if state in ("done", "failed"):
+                    pending.discard(job_id)
+                    failed += state == "failed"
+        if pending:
+            time.sleep(0.1)
+    return {"completed": len(job_ids) - len(pending), "failed": failed, "timed_out": len(pending)}
+
+
+def stage_summary(exposition):
+    """Condenses /metrics histograms into {series: {count, mean_ms}} and counters into {series: value}."""
+    sums, counts, counters = {}, {}, {}
+    types = {}
+    for line in exposition.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+            continue
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        name = series.split("{", 1)[0]
+        if name.endswith("_sum"):
+            sums[series.replace("_sum", "", 1)] = float(value)
+        elif name.endswith("_count"):
+            counts[series.replace("_count", "", 1)] = float(value)
+        elif types.get(name) == "counter":
+            counters[series] = float(value)
+    stages = {series: {"count": int(count), "mean_ms": round(sums[series] / count * 1000, 2)}
+              for series, count in counts.items() if count}
+    return {"stages": stages, "counters": counters}
+
+
+def serve_asgi(application):
+    """Runs an ASGI app under uvicorn on a background thread; returns (server, port)."""
+    import socket
+
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(application, log_level="warning", lifespan="on"))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--families", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--reads", type=int, default=500, help="number of /get-meal-plan requests")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--chunk-delay", type=float, default=0.002)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--generation-mode", default="combined",
+                        help="MEAL_PLAN_GENERATION_MODE for the app under test")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi",
+                        help="serve main.app threaded (wsgi) or asgi.application under uvicorn")
+    parser.add_argument("--job-timeout", type=float, default=300)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    fake_openai = FakeOpenAIServer(("127.0.0.1", 0), args.openai_latency, args.chunk_delay).start()
+    smtp_sink = SMTPSink(("127.0.0.1", 0)).start()
+
+    # The app uses relative data/ and meal_plans/ paths, so run it in a scratch directory
+    workdir = tempfile.mkdtemp(prefix="meal-planner-bench-")
+    os.makedirs(os.path.join(workdir, "data"))
+    os.makedirs(os.path.join(workdir, "meal_plans"))
+    os.chdir(workdir)
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": fake_openai.base_url,
+        "OPENAI_REQUESTS_PER_MINUTE": "1000000",
+        "OPENAI_TOKENS_PER_MINUTE": "1000000000",
+        "EMAIL_ADDRESS": "bench@example.com",
+        "EMAIL_PASSWORD": "",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp_sink.server_address[1]),
+        "SMTP_STARTTLS": "0",
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "MEAL_PLAN_GENERATION_MODE": args.generation_mode,
+    })
+
+    # The app prints request logs; keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args, fake_openai, smtp_sink, workdir)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def run(args, fake_openai, smtp_sink, workdir):
+    import_started = time.perf_counter()
+    if args.server == "asgi":
+        import asgi
+        app_module = asgi.main
+    else:
+        import main as app_module
+    import_seconds = time.perf_counter() - import_started
+
+    if args.server == "asgi":
+        server, port = serve_asgi(asgi.application)
+    else:
+        from werkzeug.serving import make_server
+        app_module.start_background_services()
+        server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+    base_url = f"http://127.0.0.1:{port}"
+
+    report = {
+        "config": vars(args),
+        "import_seconds": round(import_seconds, 3),
+    }
+    try:
+        families = [synthetic_family(n) for n in range(args.families)]
+
+        results, report["webhook"] = drive(
+            base_url, [("POST", "/webhook", family) for family in families], args.concurrency)
+        job_ids = [json.loads(payload).get("job_id") for _, status, payload in results if status == 202]
+        jobs_started = time.perf_counter()
+        report["webhook_jobs"] = wait_for_jobs(base_url, job_ids, args.job_timeout)
+        report["webhook_jobs"]["elapsed_seconds"] = round(time.perf_counter() - jobs_started, 3)
+
+        logins = [("POST", "/login", {"email": family[f"email_{i}"], "password": app_module.DEFAULT_PASSWORD})
+                  for family in families for i in range(1, 5)]
+        _, report["login"] = drive(base_url, logins, args.concurrency)
+
+        family_ids = sorted(os.listdir("meal_plans"))
+        if family_ids:
+            reads = [("GET", f"/get-meal-plan?family_id={family_ids[n % len(family_ids)]}", None)
+                     for n in range(args.reads)]
+            _, report["get_meal_plan"] = drive(base_url, reads, args.concurrency)
+
+        requests_before = fake_openai.requests
+        started = time.perf_counter()
+        update_report = app_module.update_meal_plan() or {}
+        report["update_meal_plan"] = {
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+            "openai_requests": fake_openai.requests - requests_before,
+            **{key: update_report.get(key) for key in
+               ("processed", "skipped", "failed", "families_per_minute")},
+        }
+
+        app_module.outbox.flush(timeout=60)
+        _, status, payload = request(base_url, "GET", "/metrics")
+        if status == 200:
+            report["metrics"] = stage_summary(payload.decode("utf-8"))
+        report["openai_requests"] = fake_openai.requests
+        report["smtp"] = {"messages": smtp_sink.messages, "connections": smtp_sink.connections}
+        # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+        scale = 1 if sys.platform == "darwin" else 1024
+        report["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        report["peak_rss_children_bytes"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    finally:
+        if args.server == "asgi":
+            server.should_exit = True
+        else:
+            server.shutdown()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+if __name__ == '__main__':
+    main()
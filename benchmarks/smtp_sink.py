@@ -0,0 +1,65 @@
+"""Minimal local SMTP server that accepts and counts every message.
+
+Plain SMTP only (run the app with SMTP_STARTTLS=0); authentication is not
+advertised, so the outbox skips login when EMAIL_PASSWORD is unset.
+"""
+import argparse
+import socketserver
+import threading
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, SMTPSinkHandler)
+        self.messages = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        self.server.count("connections")
+        self.reply("220 smtp-sink ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.wfile.write(b"250-smtp-sink\r\n250 8BITMIME\r\n")
+            elif command.startswith("DATA"):
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.server.count("messages")
+                self.reply("250 OK")
+            elif command.startswith("QUIT"):
+                self.reply("221 bye")
+                return
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply("250 OK")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+    sink = SMTPSink((args.host, args.port))
+    print(f"SMTP sink listening on {args.host}:{args.port}")
+    sink.serve_forever()
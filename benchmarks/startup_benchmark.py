@@ -0,0 +1,97 @@
+"""Cold-start benchmark: how long a fresh process takes to import the app and answer its first requests.
+
+Each run starts a new interpreter in a scratch directory, imports main, serves
+main.app on a local port and times GET / and a first POST /login (which opens
+the credential store). Reports medians over --runs as JSON:
+
+    python benchmarks/startup_benchmark.py --runs 10
+
+Compare against another checkout (e.g. the previous commit) with --repo:
+
+    git worktree add /tmp/meal-planner-before HEAD~1
+    python benchmarks/startup_benchmark.py --repo /tmp/meal-planner-before
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process; prints one JSON line with its own timings
+CHILD = r"""
+import json, sys, threading, time, urllib.error, urllib.request
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+imported = time.perf_counter()
+from werkzeug.serving import make_server
+server = make_server("127.0.0.1", 0, main.app, threaded=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base_url = f"http://127.0.0.1:{server.server_port}"
+urllib.request.urlopen(base_url + "/", timeout=30).read()
+first_request = time.perf_counter()
+login = urllib.request.Request(base_url + "/login", method="POST",
+                               data=json.dumps({"email": "nobody@example.com", "password": "x"}).encode(),
+                               headers={"Content-Type": "application/json"})
+try:
+    urllib.request.urlopen(login, timeout=30).read()
+except urllib.error.HTTPError:
+    pass
+first_login = time.perf_counter()
+heavy = [name for name in ("openai", "bcrypt", "smtplib") if name in sys.modules]
+print(json.dumps({"import_ms": (imported - started) * 1000,
+                  "first_request_ms": (first_request - started) * 1000,
+                  "first_login_ms": (first_login - first_request) * 1000,
+                  "threads": threading.active_count(), "heavy_modules_loaded": heavy}), flush=True)
+"""
+
+
+def run_once(repo):
+    workdir = tempfile.mkdtemp(prefix="meal-planner-startup-")
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "startup-benchmark"))
+    try:
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", CHILD, repo], cwd=workdir, env=env,
+                                capture_output=True, text=True, timeout=120, check=True).stdout
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    # Parent-side wall time also covers interpreter startup and process exit
+    result["process_ms"] = elapsed * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--repo", default=REPO_ROOT, help="checkout to measure (default: this one)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    runs = [run_once(os.path.abspath(args.repo)) for _ in range(args.runs)]
+    report = {
+        "repo": os.path.abspath(args.repo),
+        "runs": args.runs,
+        **{f"median_{key}": round(statistics.median(run[key] for run in runs), 1)
+           for key in ("import_ms", "first_request_ms", "first_login_ms", "process_ms")},
+        "threads_after_first_request": runs[-1]["threads"],
+        "heavy_modules_loaded": runs[-1]["heavy_modules_loaded"],
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
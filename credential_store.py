@@ -0,0 +1,260 @@
+import json
+import os
+import sqlite3
+import threading
+
+USER_FIELDS = ("first_name", "last_name", "password", "family_id", "timestamp")
+
+
+class EmailAlreadyRegistered(ValueError):
+    """Raised when a family contains an email that already has an account."""
+
+    def __init__(self, email):
+        super().__init__(f"Email already registered: {email}")
+        self.email = email
+
+
+# Base interface shared by every credential backend
+class CredentialStore:
+    def get(self, email):
+        """Returns the stored record for an email, or None."""
+        raise NotImplementedError
+
+    def find_existing(self, emails):
+        """Returns the first email from the given list that already has an account, or None."""
+        for email in emails:
+            if email and self.get(email) is not None:
+                return email
+        return None
+
+    def existing_emails(self, emails):
+        """Returns the set of the given emails that already have an account."""
+        return {email for email in set(emails) if email and self.get(email) is not None}
+
+    def get_family(self, family_id):
+        """Returns {email: record} for every member of a family."""
+        raise NotImplementedError
+
+    def add_family(self, members):
+        """Atomically adds {email: record} accounts; nothing is written if any email exists."""
+        raise NotImplementedError
+
+    def upsert_many(self, credentials):
+        """Inserts or replaces {email: record} accounts in one write."""
+        raise NotImplementedError
+
+    def update_password(self, email, hashed_password):
+        """Replaces the stored password hash of an existing account."""
+        raise NotImplementedError
+
+    def load_all(self):
+        """Returns every account as a {email: record} dict (legacy, O(total users))."""
+        raise NotImplementedError
+
+
+# Legacy backend: the whole store lives in one JSON file
+class JsonCredentialStore(CredentialStore):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}  # Return an empty dict if the file doesn't exist
+        except json.JSONDecodeError:
+            return {}  # Return an empty dict if the file is not valid JSON
+
+    def _write(self, credentials):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(credentials, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, email):
+        return self._read().get(email)
+
+    def find_existing(self, emails):
+        credentials = self._read()
+        for email in emails:
+            if email and email in credentials:
+                return email
+        return None
+
+    def existing_emails(self, emails):
+        credentials = self._read()
+        return {email for email in set(emails) if email and email in credentials}
+
+    def get_family(self, family_id):
+        return {email: info for email, info in self._read().items()
+                if info.get('family_id') == family_id}
+
+    def add_family(self, members):
+        with self._lock:
+            credentials = self._read()
+            for email in members:
+                if email in credentials:
+                    raise EmailAlreadyRegistered(email)
+            credentials.update(members)
+            self._write(credentials)
+
+    def upsert_many(self, credentials):
+        with self._lock:
+            current = self._read()
+            current.update(credentials)
+            self._write(current)
+
+    def update_password(self, email, hashed_password):
+        with self._lock:
+            credentials = self._read()
+            if email in credentials:
+                credentials[email]['password'] = hashed_password
+                self._write(credentials)
+
+    def load_all(self):
+        return self._read()
+
+
+# Embedded backend: SQLite in WAL mode, indexed by email and family_id
+class SQLiteCredentialStore(CredentialStore):
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " email TEXT PRIMARY KEY,"
+            " first_name TEXT,"
+            " last_name TEXT,"
+            " password TEXT NOT NULL,"
+            " family_id TEXT,"
+            " timestamp TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS users_family_id ON users (family_id)")
+
+    def _connection(self):
+        # sqlite3 connections are not shareable across threads, keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_record(row):
+        return dict(zip(USER_FIELDS, row, strict=True))
+
+    @staticmethod
+    def _record_to_row(email, record):
+        return (email,) + tuple(record.get(field) for field in USER_FIELDS)
+
+    def get(self, email):
+        row = self._connection().execute(
+            "SELECT first_name, last_name, password, family_id, timestamp"
+            " FROM users WHERE email = ?", (email,)).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def find_existing(self, emails):
+        emails = [email for email in emails if email]
+        if not emails:
+            return None
+        placeholders = ", ".join("?" * len(emails))
+        found = {row[0] for row in self._connection().execute(
+            f"SELECT email FROM users WHERE email IN ({placeholders})", emails)}
+        # Preserve the caller's order so the first conflicting member is reported
+        for email in emails:
+            if email in found:
+                return email
+        return None
+
+    def existing_emails(self, emails):
+        emails = sorted({email for email in emails if email})
+        found = set()
+        # Stay under SQLite's limit on bound parameters per statement
+        for start in range(0, len(emails), 500):
+            chunk = emails[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            found.update(row[0] for row in self._connection().execute(
+                f"SELECT email FROM users WHERE email IN ({placeholders})", chunk))
+        return found
+
+    def get_family(self, family_id):
+        rows = self._connection().execute(
+            "SELECT email, first_name, last_name, password, family_id, timestamp"
+            " FROM users WHERE family_id = ? ORDER BY rowid", (family_id,))
+        return {row[0]: self._row_to_record(row[1:]) for row in rows}
+
+    def _write_many(self, sql, members):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(sql, [self._record_to_row(email, record)
+                                   for email, record in members.items()])
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def add_family(self, members):
+        try:
+            self._write_many("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", members)
+        except sqlite3.IntegrityError as e:
+            existing = self.find_existing(list(members))
+            raise EmailAlreadyRegistered(existing or next(iter(members), None)) from e
+
+    def upsert_many(self, credentials):
+        self._write_many("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)", credentials)
+
+    def update_password(self, email, hashed_password):
+        self._connection().execute(
+            "UPDATE users SET password = ? WHERE email = ?", (hashed_password, email))
+
+    def load_all(self):
+        rows = self._connection().execute(
+            "SELECT email, first_name, last_name, password, family_id, timestamp"
+            " FROM users ORDER BY rowid")
+        return {row[0]: self._row_to_record(row[1:]) for row in rows}
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def migrate_json_to_sqlite(json_path, store):
+    """Copies every account from a legacy JSON credentials file into a SQLite store."""
+    credentials = JsonCredentialStore(json_path).load_all()
+    if credentials:
+        store.upsert_many(credentials)
+    return len(credentials)
+
+
+def create_credential_store(backend=None, json_path='data/user_credentials.json',
+                            db_path='data/user_credentials.db'):
+    """Builds the configured credential store, importing the legacy JSON file on first use."""
+    backend = backend or os.getenv('CREDENTIAL_BACKEND', 'sqlite')
+    if backend == 'json':
+        return JsonCredentialStore(json_path)
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown credential backend: {backend}")
+
+    store = SQLiteCredentialStore(db_path)
+    if store.count() == 0 and os.path.exists(json_path):
+        migrated = migrate_json_to_sqlite(json_path, store)
+        print(f"Migrated {migrated} accounts from {json_path} to {db_path}")
+    return store
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Usage: python credential_store.py [json_path] [db_path]
+    source = sys.argv[1] if len(sys.argv) > 1 else 'data/user_credentials.json'
+    target = sys.argv[2] if len(sys.argv) > 2 else 'data/user_credentials.db'
+    count = migrate_json_to_sqlite(source, SQLiteCredentialStore(target))
+    print(f"Migrated {count} accounts from {source} to {target}")
@@ -1,8 +1,15 @@
 import logging
+import time
 import traceback
 from functools import wraps
 
-from flask import jsonify
+from flask import Response, jsonify, request
+
+import metrics
+
+ROUTE_SECONDS = metrics.histogram(
+    "meal_planner_http_request_seconds", "Time to build a route's response, before it is streamed",
+    ("route", "method", "status"))
 
 # Configure logging
 logging.basicConfig(
@@ -27,3 +34,27 @@ def handle_errors(func):
             logging.error(traceback.format_exc())
             return jsonify({"error": "Internal error", "message": "An unexpected error occurred"}), 500
     return wrapper
+
+
+def _status_code(result):
+    if isinstance(result, Response):
+        return result.status_code
+    if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int):
+        return result[1]
+    return 200
+
+
+def track_latency(func):
+    """Records a route's latency by URL rule, method and status; apply outside handle_errors."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        status = 500
+        try:
+            result = func(*args, **kwargs)
+            status = _status_code(result)
+            return result
+        finally:
+            route = request.url_rule.rule if request.url_rule is not None else func.__name__
+            ROUTE_SECONDS.labels(route, request.method, status).observe(time.perf_counter() - started)
+    return wrapper
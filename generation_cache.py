@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Values the sign-up form uses to mean "no restrictions"
+EMPTY_RESTRICTIONS = {"", "none", "no", "n/a", "na", "nil"}
+
+
+def normalize_restrictions(restrictions):
+    """Turns free-text restrictions into a sorted tuple of unique lowercase tokens."""
+    if not restrictions:
+        return ()
+    tokens = {token.strip().lower() for token in re.split(r"[,;/\n]+", str(restrictions))}
+    return tuple(sorted(token for token in tokens if token not in EMPTY_RESTRICTIONS))
+
+
+def _members_by_profile(member_restrictions):
+    """Member indexes 1-4 ordered by normalized restrictions, ignoring their position in the family."""
+    profiles = {i: normalize_restrictions(member_restrictions.get(f"restrictions_{i}"))
+                for i in range(1, 5)}
+    order = sorted(profiles, key=lambda i: (profiles[i], i))
+    return order, [profiles[i] for i in order]
+
+
+def family_cache_key(member_restrictions):
+    _, profiles = _members_by_profile(member_restrictions)
+    return hashlib.sha256(json.dumps(profiles).encode('utf-8')).hexdigest()
+
+
+# Two-tier (memory LRU + disk) cache of generated meal plans keyed by the family's restrictions
+class GenerationCache:
+    def __init__(self, folder='data/generation_cache', max_entries=1024, ttl_seconds=7 * 24 * 3600):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def _expired(self, stored_at):
+        return time.time() - stored_at > self.ttl_seconds
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry["stored_at"]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+
+        try:
+            with open(self._path(key), 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+
+        with self._lock:
+            if entry is None or self._expired(entry["stored_at"]):
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+            return entry
+
+    def get(self, member_restrictions):
+        """Returns a cached plan remapped onto this family's emails (as a JSON string), or None."""
+        entry = self._lookup(family_cache_key(member_restrictions))
+        if entry is None:
+            return None
+        order, _ = _members_by_profile(member_restrictions)
+        member_plans = dict(zip(order, entry["plans"], strict=True))
+        meal_plan = {member_restrictions[f"email_{i}"]: member_plans[i] for i in range(1, 5)}
+        return json.dumps(meal_plan, indent=2)
+
+    def put(self, member_restrictions, meal_plan):
+        """Caches a generated plan; plans that are not valid per-email JSON are ignored."""
+        try:
+            parsed = json.loads(meal_plan) if isinstance(meal_plan, str) else meal_plan
+            order, _ = _members_by_profile(member_restrictions)
+            plans = [parsed[member_restrictions[f"email_{i}"]] for i in order]
+        except (ValueError, KeyError, TypeError):
+            return False
+
+        key = family_cache_key(member_restrictions)
+        entry = {"stored_at": time.time(), "plans": plans}
+        # Families with the same restrictions can be stored concurrently; give each writer its own file
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._remember(key, entry)
+            self._puts += 1
+            prune = self._puts % 100 == 0
+        if prune:
+            self.prune()
+        return True
+
+    def prune(self):
+        """Deletes expired entries from the disk tier."""
+        removed = 0
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                if time.time() - entry.stat().st_mtime > self.ttl_seconds:
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+        return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,348 @@
+import asyncio
+import contextlib
+import inspect
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime as dt
+
+import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOBS_IN_FLIGHT = metrics.gauge("meal_planner_jobs_in_flight", "Jobs currently running", ("kind",))
+JOB_SECONDS = metrics.histogram(
+    "meal_planner_job_seconds", "Background job run time by outcome", ("kind", "status"))
+
+
+class Job:
+    """A claimed job handed to a handler; progress updates are persisted immediately."""
+
+    def __init__(self, queue, job_id, kind, payload):
+        self.queue = queue
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+
+    def report_progress(self, progress):
+        self.queue._update(self.id, progress=progress)
+
+
+# Durable job queue backed by SQLite, drained by a bounded pool of worker threads.
+# Several processes may drain the same database: a claimed job records its owner and a
+# lease the owner keeps renewing, and only jobs whose lease ran out are taken back.
+class JobQueue:
+    def __init__(self, path='data/jobs.db', max_workers=2, poll_interval=1.0, lease_seconds=60):
+        self.path = path
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._workers = []
+        self._stopping = False
+        self._async_wakeup = None
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " progress TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL,"
+            " key TEXT,"
+            " owner TEXT,"
+            " lease_expires_at REAL)"
+        )
+        # Databases created before jobs had keys and leases
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        for column, column_type in (("key", "TEXT"), ("owner", "TEXT"), ("lease_expires_at", "REAL")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _now():
+        return dt.utcnow().isoformat()
+
+    def register(self, kind, handler):
+        """Registers handler(job) for a job kind; its return value is stored as the job result.
+
+        The handler may be a coroutine function; it then runs on the event loop under
+        run_async(), or in its own loop on a worker thread otherwise.
+        """
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind, payload, key=None):
+        """Persists a job and wakes a worker; returns the job id.
+
+        Jobs with the same key (e.g. a family id) run one at a time, in the order
+        they were enqueued, across every process sharing the database.
+        """
+        job_id = str(uuid.uuid4())
+        now = self._now()
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, payload, status, progress, created_at, updated_at, key)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), QUEUED, "queued", now, now, key))
+        with self._wakeup:
+            self._wakeup.notify()
+        if self._async_wakeup is not None:
+            loop, event = self._async_wakeup
+            loop.call_soon_threadsafe(event.set)
+        return job_id
+
+    def enqueue_many(self, kind, payloads, keys=None):
+        """Persists several jobs in one transaction and wakes the workers; returns their ids in order."""
+        job_ids = [str(uuid.uuid4()) for _ in payloads]
+        keys = keys or [None] * len(payloads)
+        now = self._now()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO jobs (id, kind, payload, status, progress, created_at, updated_at, key)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, kind, json.dumps(payload), QUEUED, "queued", now, now, key)
+                 for job_id, payload, key in zip(job_ids, payloads, keys, strict=True)])
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        with self._wakeup:
+            self._wakeup.notify_all()
+        if self._async_wakeup is not None:
+            loop, event = self._async_wakeup
+            loop.call_soon_threadsafe(event.set)
+        return job_ids
+
+    def get(self, job_id):
+        """Returns the public status of a job, or None if it does not exist."""
+        row = self._connection().execute(
+            "SELECT id, kind, status, progress, result, error, attempts, created_at, updated_at"
+            " FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "progress": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "attempts": row[6],
+            "created_at": row[7],
+            "updated_at": row[8],
+        }
+
+    def latest(self, kind, key):
+        """Returns the public status of the most recently enqueued job of a kind with this key, or None."""
+        row = self._connection().execute(
+            "SELECT id FROM jobs WHERE key = ? AND kind = ? ORDER BY rowid DESC LIMIT 1",
+            (key, kind)).fetchone()
+        return self.get(row[0]) if row is not None else None
+
+    def _update(self, job_id, **fields):
+        # Only while this queue still holds the claim; a job whose lease expired may be
+        # running elsewhere by now
+        fields["updated_at"] = self._now()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection().execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ? AND owner = ?",
+            (*fields.values(), job_id, self.owner))
+
+    def _claim(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A keyed job waits while an earlier job with its key is queued or running
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs AS job WHERE status = ?"
+                " AND (key IS NULL OR NOT EXISTS ("
+                "  SELECT 1 FROM jobs AS other WHERE other.key = job.key AND other.rowid != job.rowid"
+                "  AND (other.status = ? OR (other.status = ? AND other.rowid < job.rowid))))"
+                " ORDER BY created_at LIMIT 1", (QUEUED, RUNNING, QUEUED)).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, progress = ?, attempts = attempts + 1,"
+                    " updated_at = ?, owner = ?, lease_expires_at = ? WHERE id = ?",
+                    (RUNNING, "started", self._now(), self.owner,
+                     time.time() + self.lease_seconds, row[0]))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if row is None:
+            return None
+        return Job(self, row[0], row[1], json.loads(row[2]))
+
+    def _finish(self, job, started, result=None, error=None):
+        if error is not None:
+            logging.error(f"Job {job.id} ({job.kind}) failed: {error}")
+            logging.error("".join(traceback.format_exception(error)))
+            self._update(job.id, status=FAILED, progress="failed", error=str(error))
+            JOB_SECONDS.labels(job.kind, FAILED).observe(time.perf_counter() - started)
+        else:
+            self._update(job.id, status=DONE, progress="done",
+                         result=json.dumps(result) if result is not None else None)
+            JOB_SECONDS.labels(job.kind, DONE).observe(time.perf_counter() - started)
+
+    def _run(self, job):
+        handler = self._handlers.get(job.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind: {job.kind}")
+            with JOBS_IN_FLIGHT.labels(job.kind).track_inprogress():
+                result = handler(job)
+                if inspect.isawaitable(result):
+                    result = asyncio.run(result)
+        except Exception as e:
+            self._finish(job, started, error=e)
+        else:
+            self._finish(job, started, result)
+
+    async def _run_async(self, job):
+        handler = self._handlers.get(job.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind: {job.kind}")
+            with JOBS_IN_FLIGHT.labels(job.kind).track_inprogress():
+                if inspect.iscoroutinefunction(handler):
+                    result = await handler(job)
+                else:
+                    result = await asyncio.to_thread(handler, job)
+        except Exception as e:
+            await asyncio.to_thread(self._finish, job, started, None, e)
+        else:
+            await asyncio.to_thread(self._finish, job, started, result)
+
+    def _worker(self):
+        while not self._stopping:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self._run(job)
+
+    def _heartbeat(self):
+        """Renews the leases of this queue's running jobs and re-queues jobs whose lease ran out."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE status = ? AND owner = ?",
+            (now + self.lease_seconds, RUNNING, self.owner))
+        # The owner stopped renewing (it crashed or was killed); running jobs left by
+        # versions without leases have none and are taken back as well
+        conn.execute(
+            "UPDATE jobs SET status = ?, progress = ?, owner = NULL, lease_expires_at = NULL,"
+            " updated_at = ? WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+            (QUEUED, "requeued after its worker stopped", self._now(), RUNNING, now))
+
+    def _heartbeat_loop(self):
+        while not self._stopping:
+            try:
+                self._heartbeat()
+            except sqlite3.Error as e:
+                logging.error(f"Job lease heartbeat failed: {e}")
+            with self._wakeup:
+                self._wakeup.wait(self.lease_seconds / 3)
+
+    def start(self):
+        """Re-queues jobs whose worker died and starts the worker and heartbeat threads."""
+        if self._workers:
+            return
+        self._heartbeat()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._workers.append(heartbeat)
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    async def run_async(self, concurrency=100):
+        """Drains the queue on the running event loop, with up to `concurrency` jobs in flight.
+
+        Use instead of start(): a job waiting on the network holds a task, not a thread.
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self._async_wakeup = (loop, wakeup)
+        await asyncio.to_thread(self._heartbeat)
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                try:
+                    await asyncio.to_thread(self._heartbeat)
+                except sqlite3.Error as e:
+                    logging.error(f"Job lease heartbeat failed: {e}")
+
+        heartbeat_task = loop.create_task(heartbeat())
+
+        def finished(task):
+            tasks.discard(task)
+            slots.release()
+
+        try:
+            while not self._stopping:
+                await slots.acquire()
+                # Clear before claiming so a job enqueued meanwhile still wakes us
+                wakeup.clear()
+                job = await asyncio.to_thread(self._claim)
+                if job is None:
+                    slots.release()
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+                    continue
+                task = loop.create_task(self._run_async(job))
+                tasks.add(task)
+                task.add_done_callback(finished)
+        finally:
+            heartbeat_task.cancel()
+            self._async_wakeup = None
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        if self._async_wakeup is not None:
+            loop, event = self._async_wakeup
+            loop.call_soon_threadsafe(event.set)
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+        self._stopping = False
@@ -0,0 +1,31 @@
+import threading
+
+
+# Stand-in for a module-level service that is only built when first used, so importing
+# the app opens no databases and creates no folders
+class LazyService:
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """Returns the service, building it on the first call."""
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+                instance = self._instance
+        return instance
+
+    @property
+    def initialized(self):
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        # Only called for attributes LazyService itself does not define, so its own names
+        # (resolve, initialized) must not clash with the wrapped services' methods
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
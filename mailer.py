@@ -0,0 +1,457 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+RETRYING = "retrying"
+FAILED = "failed"
+
+SMTP_CONNECT_SECONDS = metrics.histogram(
+    "meal_planner_smtp_connect_seconds", "Time to open, secure and log in to an SMTP session")
+SMTP_SEND_SECONDS = metrics.histogram(
+    "meal_planner_smtp_send_seconds", "Time to hand one message to the SMTP server")
+EMAIL_DELIVERY_SECONDS = metrics.histogram(
+    "meal_planner_email_delivery_seconds", "Time from queueing an email to the server accepting it")
+EMAILS = metrics.counter("meal_planner_emails_total", "Email delivery attempts by outcome", ("status",))
+
+
+class SMTPConfig:
+    """Connection settings for the outbound mail server, read from the environment by default."""
+
+    def __init__(self, host=None, port=None, username=None, password=None, starttls=None):
+        self.host = host or os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+        self.port = int(port or os.getenv('SMTP_PORT', '587'))
+        self.username = username if username is not None else os.getenv('EMAIL_ADDRESS')
+        self.password = password if password is not None else os.getenv('EMAIL_PASSWORD')
+        if starttls is None:
+            starttls = os.getenv('SMTP_STARTTLS', '1') not in ('0', 'false', 'False')
+        self.starttls = starttls
+
+
+# Keeps a few authenticated SMTP sessions open so messages skip the TLS and login handshake
+class SMTPConnectionPool:
+    def __init__(self, config, size=2, timeout=30):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        # Imported on first use so loading the app stays cheap
+        import smtplib
+
+        with SMTP_CONNECT_SECONDS.time():
+            server = smtplib.SMTP(self.config.host, self.config.port, timeout=self.timeout)
+            if self.config.starttls:
+                server.starttls()
+            if self.config.username and self.config.password:
+                server.login(self.config.username, self.config.password)
+        return server
+
+    @staticmethod
+    def _is_alive(server):
+        import smtplib
+
+        try:
+            return server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def acquire(self):
+        """Returns a live connection, reusing an idle one when possible."""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._is_alive(server):
+                    return server
+                self._close(server)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, server):
+        self._idle.put(server)
+        self._slots.release()
+
+    def discard(self, server):
+        """Drops a connection that failed mid-session."""
+        self._close(server)
+        self._slots.release()
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+# Outbox: queues messages and drains them in batches on background threads
+class Outbox:
+    def __init__(self, config=None, pool_size=2, workers=2, batch_size=20,
+                 max_attempts=5, backoff=2.0, max_tracked=10000):
+        self.pool = self._create_pool(config or SMTPConfig(), pool_size)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_tracked = max_tracked
+        self._queue = queue.Queue()
+        self._messages = {}
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    @staticmethod
+    def _create_pool(config, size):
+        return SMTPConnectionPool(config, size=size)
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def send(self, message):
+        """Queues one message and returns its id."""
+        return self.send_batch([message])[0]
+
+    def send_batch(self, messages):
+        """Queues messages to go out together on one connection; returns their ids."""
+        message_ids = []
+        with self._lock:
+            for message in messages:
+                message_id = str(uuid.uuid4())
+                self._messages[message_id] = message
+                self._statuses[message_id] = {
+                    "id": message_id,
+                    "recipient": message["To"],
+                    "status": QUEUED,
+                    "attempts": 0,
+                    "error": None,
+                    "queued_at": time.monotonic(),
+                }
+                message_ids.append(message_id)
+            self._trim()
+        self._enqueue(message_ids)
+        return message_ids
+
+    def _enqueue(self, message_ids):
+        self._queue.put(message_ids)
+        self.start()
+
+    def status(self, message_id):
+        """Returns the delivery status of a message, or None if it is unknown."""
+        with self._lock:
+            status = self._statuses.get(message_id)
+            if status is None:
+                return None
+            return {key: value for key, value in status.items() if key != "queued_at"}
+
+    def pending(self):
+        with self._lock:
+            return len(self._messages)
+
+    def flush(self, timeout=None):
+        """Blocks until every queued message is sent or has failed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _trim(self):
+        # Forget the oldest finished messages so status tracking stays bounded
+        while len(self._statuses) > self.max_tracked:
+            oldest_id, oldest = next(iter(self._statuses.items()))
+            if oldest["status"] not in (SENT, FAILED):
+                break
+            self._statuses.pop(oldest_id)
+
+    def _set_status(self, message_id, **fields):
+        with self._lock:
+            self._statuses[message_id].update(fields)
+
+    def _next_batch(self):
+        message_ids = list(self._queue.get())
+        # Coalesce whatever else is already waiting, up to the batch size
+        while len(message_ids) < self.batch_size:
+            try:
+                message_ids.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return message_ids
+
+    def _worker(self):
+        while True:
+            message_ids = self._next_batch()
+            try:
+                server = self.pool.acquire()
+            except Exception as e:
+                for message_id in message_ids:
+                    self._retry_or_fail(message_id, e, count_attempt=True)
+                continue
+
+            healthy = True
+            try:
+                for index, message_id in enumerate(message_ids):
+                    if not healthy:
+                        # Connection dropped; hand the rest of the batch back to the queue
+                        self._enqueue(message_ids[index:])
+                        break
+                    healthy = self._deliver(server, message_id)
+            except BaseException:
+                healthy = False
+                raise
+            finally:
+                # Always hand the connection back, or the pool loses a slot for good
+                if healthy:
+                    self.pool.release(server)
+                else:
+                    self.pool.discard(server)
+
+    def _deliver(self, server, message_id):
+        """Sends one message; returns False if the connection is no longer usable."""
+        import smtplib
+
+        message, queued_at = self._begin_delivery(message_id)
+        try:
+            with SMTP_SEND_SECONDS.time():
+                server.send_message(message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                smtplib.SMTPDataError) as e:
+            # The server rejected this message, but the session is still fine
+            self._retry_or_fail(message_id, e)
+            return True
+        except (smtplib.SMTPException, OSError) as e:
+            self._retry_or_fail(message_id, e)
+            return False
+        except Exception as e:
+            # Anything else (e.g. a message that cannot be serialized) must not kill the
+            # worker; the session may be mid-command, so it is not reused
+            logging.error(f"Unexpected error sending email to {message['To']}: {e!r}")
+            self._retry_or_fail(message_id, e)
+            return False
+
+        self._delivered(message_id, message, queued_at)
+        return True
+
+    def _begin_delivery(self, message_id):
+        with self._lock:
+            message = self._messages[message_id]
+            status = self._statuses[message_id]
+            status["status"] = SENDING
+            status["attempts"] += 1
+            return message, status["queued_at"]
+
+    def _delivered(self, message_id, message, queued_at):
+        self._set_status(message_id, status=SENT, error=None)
+        with self._lock:
+            self._messages.pop(message_id, None)
+        EMAILS.labels(SENT).inc()
+        EMAIL_DELIVERY_SECONDS.observe(time.monotonic() - queued_at)
+        print(f"Email sent to {message['To']}")
+
+    def _retry_or_fail(self, message_id, error, count_attempt=False):
+        with self._lock:
+            status = self._statuses[message_id]
+            if count_attempt:
+                # Never reached the server (e.g. connect failed) but still counts
+                status["attempts"] += 1
+            attempts = status["attempts"]
+            if attempts >= self.max_attempts:
+                status.update(status=FAILED, error=str(error))
+                self._messages.pop(message_id, None)
+                logging.error(f"Failed to send email to {status['recipient']}: {error}")
+                EMAILS.labels(FAILED).inc()
+                return
+            status.update(status=RETRYING, error=str(error))
+        EMAILS.labels(RETRYING).inc()
+
+        delay = self.backoff * (2 ** (attempts - 1))
+        timer = threading.Timer(delay, self._enqueue, args=([message_id],))
+        timer.daemon = True
+        timer.start()
+
+
+# Async counterparts built on aiosmtplib, an optional dependency used only by the ASGI entry point
+
+class AsyncSMTPConnectionPool:
+    def __init__(self, config, size=2, timeout=30):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = None
+
+    async def _connect(self):
+        import aiosmtplib
+
+        with SMTP_CONNECT_SECONDS.time():
+            server = aiosmtplib.SMTP(hostname=self.config.host, port=self.config.port,
+                                     start_tls=self.config.starttls, timeout=self.timeout)
+            await server.connect()
+            if self.config.username and self.config.password:
+                await server.login(self.config.username, self.config.password)
+        return server
+
+    @staticmethod
+    async def _is_alive(server):
+        try:
+            return (await server.noop())[0] == 250
+        except Exception:
+            return False
+
+    async def acquire(self):
+        if self._slots is None:
+            # Created here so the semaphore belongs to the running event loop
+            self._slots = asyncio.Semaphore(self.size)
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                server = self._idle.pop()
+                if await self._is_alive(server):
+                    return server
+                await self._close(server)
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, server):
+        self._idle.append(server)
+        self._slots.release()
+
+    async def discard(self, server):
+        await self._close(server)
+        self._slots.release()
+
+    @staticmethod
+    async def _close(server):
+        try:
+            await server.quit()
+        except Exception:
+            server.close()
+
+    async def close(self):
+        while self._idle:
+            await self._close(self._idle.pop())
+
+
+# Outbox whose workers are tasks on an event loop; send()/send_batch() stay callable from any thread
+class AsyncOutbox(Outbox):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._async_queue = None
+        self._waiting = []
+        self._tasks = []
+
+    @staticmethod
+    def _create_pool(config, size):
+        return AsyncSMTPConnectionPool(config, size=size)
+
+    def start(self):
+        """Workers start in bind(), once the event loop is known."""
+
+    def bind(self, loop):
+        """Starts the workers on `loop` (call from inside it) and releases messages queued before."""
+        self._async_queue = asyncio.Queue()
+        for _ in range(self.workers):
+            self._tasks.append(loop.create_task(self._async_worker()))
+        with self._lock:
+            self._loop = loop
+            waiting, self._waiting = self._waiting, []
+        for message_ids in waiting:
+            self._async_queue.put_nowait(message_ids)
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.pool.close()
+
+    def _enqueue(self, message_ids):
+        with self._lock:
+            if self._loop is None:
+                self._waiting.append(message_ids)
+                return
+        self._loop.call_soon_threadsafe(self._async_queue.put_nowait, message_ids)
+
+    async def _next_async_batch(self):
+        message_ids = list(await self._async_queue.get())
+        while len(message_ids) < self.batch_size:
+            try:
+                message_ids.extend(self._async_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return message_ids
+
+    async def _async_worker(self):
+        import aiosmtplib
+
+        while True:
+            message_ids = await self._next_async_batch()
+            try:
+                server = await self.pool.acquire()
+            except Exception as e:
+                for message_id in message_ids:
+                    self._retry_or_fail(message_id, e, count_attempt=True)
+                continue
+
+            healthy = True
+            try:
+                for index, message_id in enumerate(message_ids):
+                    if not healthy:
+                        self._enqueue(message_ids[index:])
+                        break
+                    message, queued_at = self._begin_delivery(message_id)
+                    try:
+                        with SMTP_SEND_SECONDS.time():
+                            await server.send_message(message)
+                    except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPSenderRefused,
+                            aiosmtplib.SMTPDataError) as e:
+                        self._retry_or_fail(message_id, e)
+                    except (aiosmtplib.SMTPException, OSError) as e:
+                        self._retry_or_fail(message_id, e)
+                        healthy = False
+                    except Exception as e:
+                        logging.error(f"Unexpected error sending email to {message['To']}: {e!r}")
+                        self._retry_or_fail(message_id, e)
+                        healthy = False
+                    else:
+                        self._delivered(message_id, message, queued_at)
+            except BaseException:
+                healthy = False
+                raise
+            finally:
+                if healthy:
+                    self.pool.release(server)
+                else:
+                    await self.pool.discard(server)
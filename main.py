@@ -1,43 +1,141 @@
+import asyncio
+import contextlib
+import functools
 import json
 import os
-import smtplib
-import threading
+import queue
+import sys
 import time
 import uuid
+import zlib
 from datetime import datetime as dt
+from datetime import timedelta
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-import bcrypt
 import pytz
-import schedule
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 
-from error_handler import handle_errors
-from meal_services import MealPlanSaver, MealPlanService
-
-app = Flask(__name__)
-CORS(app)
-
-# Initialize service instances
+import metrics
+from batch_regeneration import BatchRun, LocalBatchBackend, OpenAIBatchBackend
+from credential_store import EmailAlreadyRegistered, create_credential_store
+from error_handler import handle_errors, track_latency
+from generation_cache import GenerationCache, normalize_restrictions
+from job_queue import FAILED, QUEUED, RUNNING, JobQueue
+from lazy_service import LazyService
+from mailer import AsyncOutbox, Outbox, SMTPConfig
+from meal_services import (
+    MEALS,
+    MealPlanSaver,
+    MealPlanService,
+    build_plan_index,
+    canonical_meal_plan,
+    parse_json_response,
+)
+from password_hashing import PasswordHasher
+from plan_history import WEEK_PATTERN, MealPlanHistory, plan_week
+from plan_stream import IncrementalPlanParser, PlanStreamBroker, format_sse
+from plan_validation import DAYS, PlanValidation, RepairStats, parse_member_response
+from rate_limiter import RateLimiter
+from regeneration import RegenerationEngine
+from response_cache import (
+    CachedResponse,
+    MealPlanResponseCache,
+    SliceNotFound,
+    slice_plan_index,
+)
+from scheduler import LeaderScheduler, SchedulerStore
+
+# Every route; create_app() mounts them on a Flask app
+routes = Blueprint('meal_planner', __name__)
+
+# "threaded" (default) runs jobs and mail on worker threads; "async" runs them on the
+# ASGI server's event loop with non-blocking OpenAI and SMTP clients (see asgi.py)
+EXECUTION_MODE = os.getenv('EXECUTION_MODE', 'threaded')
+
+# Initialize service instances. Those that touch disk (databases, cache folders) are
+# LazyService stand-ins built on first use, so importing this module has no side effects.
 api_key = os.getenv('OPENAI_API_KEY')
-meal_plan_service = MealPlanService(api_key=api_key)
-meal_plan_saver = MealPlanSaver()
+# Which slice of the families this process regenerates (hashed on family_id)
+REGENERATION_SHARD_INDEX = int(os.getenv('REGENERATION_SHARD_INDEX', '0'))
+REGENERATION_SHARD_COUNT = int(os.getenv('REGENERATION_SHARD_COUNT', '1'))
+# Shared OpenAI budget; every generation (webhooks and the weekly run) waits on it.
+# The limits are for the whole organization, so each shard gets an equal part
+openai_rate_limiter = RateLimiter(
+    requests_per_minute=max(1, int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500')) // REGENERATION_SHARD_COUNT),
+    tokens_per_minute=max(1, int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '200000')) // REGENERATION_SHARD_COUNT))
+meal_plan_service = MealPlanService(api_key=api_key, rate_limiter=openai_rate_limiter)
+meal_plan_history = MealPlanHistory('meal_plans')
+meal_plan_saver = MealPlanSaver(history=meal_plan_history)
+# How many archived weeks of dishes the weekly prompt asks the model not to repeat
+HISTORY_CONTEXT_WEEKS = int(os.getenv('HISTORY_CONTEXT_WEEKS', '2'))
+meal_plan_response_cache = MealPlanResponseCache('meal_plans')
+meal_plan_saver.add_save_listener(meal_plan_response_cache.invalidate)
+# "combined" asks for the whole family in one completion; "decomposed" makes one
+# smaller request per distinct restriction profile and runs them concurrently;
+# "streaming" is combined but saves and pushes each day as soon as it is parsed
+MEAL_PLAN_GENERATION_MODE = os.getenv('MEAL_PLAN_GENERATION_MODE', 'combined')
+MEMBER_MAX_TOKENS = int(os.getenv('MEMBER_MAX_TOKENS', '1024'))
+# Rounds of targeted requests for members/days missing from a generated plan
+PLAN_REPAIR_ATTEMPTS = int(os.getenv('PLAN_REPAIR_ATTEMPTS', '2'))
+repair_stats = RepairStats()
+plan_stream_broker = PlanStreamBroker()
+# Seconds between checks of 1.json and the job status while a stream hears no in-process events
+STREAM_POLL_SECONDS = float(os.getenv('STREAM_POLL_SECONDS', '1'))
+# First plans for new families are reused across families with the same restrictions
+generation_cache = LazyService(lambda: GenerationCache(
+    'data/generation_cache',
+    max_entries=int(os.getenv('GENERATION_CACHE_SIZE', '1024')),
+    ttl_seconds=int(os.getenv('GENERATION_CACHE_TTL', str(7 * 24 * 3600)))))
 user_credentials_file = 'data/user_credentials.json'
-member_restriction_file = 'data/member_restrictions.json'
+# bcrypt runs in worker processes; changing BCRYPT_ROUNDS rehashes passwords on next login
+password_hasher = PasswordHasher(rounds=int(os.getenv('BCRYPT_ROUNDS', '12')),
+                                 workers=int(os.getenv('BCRYPT_WORKERS', '0')) or None)
+credential_store = LazyService(lambda: create_credential_store(json_path=user_credentials_file))
+# Most families /webhook/batch accepts in one request
+WEBHOOK_BATCH_MAX = int(os.getenv('WEBHOOK_BATCH_MAX', '500'))
+# create_job_queue() is defined below, next to the handlers it registers
+job_queue = LazyService(lambda: create_job_queue())
+# Maximum number of families regenerated at once by the weekly run
+REGENERATION_CONCURRENCY = int(os.getenv('REGENERATION_CONCURRENCY', '8'))
+REGENERATION_JOB = "update_meal_plan"
+# Leases and (job, week, family) idempotency records shared by every process
+scheduler_store = LazyService(lambda: SchedulerStore(os.getenv('SCHEDULER_DB', 'data/scheduler.db')))
+meal_plan_scheduler = LeaderScheduler(
+    scheduler_store,
+    lease_name=f"scheduler:shard-{REGENERATION_SHARD_INDEX}",
+    ttl=int(os.getenv('SCHEDULER_LEASE_TTL', '60')))
+# A leader elected this many hours after the Sunday run was due starts it if no process did
+SCHEDULER_CATCH_UP_HOURS = float(os.getenv('SCHEDULER_CATCH_UP_HOURS', '24'))
+RUN_SCHEDULER = os.getenv('RUN_SCHEDULER', '1') not in ('0', 'false', 'False')
+# "sync" regenerates families with live completions; "batch" submits the whole week
+# as Batch API files and applies the results once they are ready
+REGENERATION_MODE = os.getenv('REGENERATION_MODE', 'sync')
+# "openai" uses the OpenAI Batch API; "local" runs the batch file against the regular
+# completions endpoint in-process (for tests and local runs)
+BATCH_BACKEND = os.getenv('BATCH_BACKEND', 'openai')
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '50000'))
+BATCH_POLL_INTERVAL = float(os.getenv('BATCH_POLL_INTERVAL', '60'))
+
+# Initial password emailed to every new member
+DEFAULT_PASSWORD = "random_password"
 
 # Email configuration 
 EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
-SMTP_SERVER = 'smtp.gmail.com'
-SMTP_PORT = 587
+SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+outbox_class = AsyncOutbox if EXECUTION_MODE == 'async' else Outbox
+outbox = outbox_class(SMTPConfig(SMTP_SERVER, SMTP_PORT, EMAIL_ADDRESS, EMAIL_PASSWORD),
+                      pool_size=int(os.getenv('SMTP_POOL_SIZE', '2')))
+metrics.gauge("meal_planner_outbox_pending", "Emails queued or waiting to retry").set_function(outbox.pending)
 
 # Define the PKT timezone
 pkt_timezone = pytz.timezone('Asia/Karachi')
 
 
-def generate_meal_plan_prompt(member_restrictions, previous_meal_plans=None):
+def generate_meal_plan_prompt(member_restrictions, previous_meal_plans=None, recent_dishes=None):
     """Generates a prompt for creating a weekly meal plan based on dietary restrictions of family members and previous meal plans."""
 
     # Start building the meal plan prompt
@@ -53,11 +151,20 @@ def generate_meal_plan_prompt(member_restrictions, previous_meal_plans=None):
 
     # Add previous meal plans to the prompt if provided
     if previous_meal_plans:
+        if not isinstance(previous_meal_plans, str):
+            previous_meal_plans = json.dumps(previous_meal_plans)
         meal_plan_prompt += (
             f"If any previous meal plans are provided, consider them while generating a new plan:\n"
             f"{previous_meal_plans}\n\n"
         )
 
+    # A compact list of recent dishes is much cheaper context than whole previous plans
+    if recent_dishes:
+        meal_plan_prompt += (
+            f"Avoid repeating these recently served dishes:\n"
+            f"{'; '.join(recent_dishes)}\n\n"
+        )
+
     meal_plan_prompt += (
         f"**Format the response in valid parsed JSON with the following structure**:\n\n"
         f"{{\n"
@@ -101,38 +208,300 @@ def generate_meal_plan_prompt(member_restrictions, previous_meal_plans=None):
     )
 
     return meal_plan_prompt
-    
+
+
+def generate_member_meal_plan_prompt(restrictions, previous_meal_plan=None, recent_dishes=None,
+                                     days=DAYS):
+    """Generates a prompt for one member's 7-day meal plan; members with the same restrictions share it.
+
+    Pass a subset of `days` to ask only for those days of the week.
+    """
+
+    if len(days) == len(DAYS):
+        meal_plan_prompt = (
+            f"Generate a 7-day weekly meal plan for one person with the following dietary restrictions: "
+            f"{restrictions or 'None'}\n\n"
+        )
+    else:
+        meal_plan_prompt = (
+            f"Generate the meals for day(s) {', '.join(str(day) for day in days)} of a 7-day weekly "
+            f"meal plan for one person with the following dietary restrictions: {restrictions or 'None'}\n\n"
+        )
+    meal_plan_prompt += (
+        "Each day's plan should include breakfast, lunch, and dinner. Ensure the meals are balanced, "
+        "varied, and realistic, using common ingredients. Avoid any restricted items mentioned above.\n\n"
+    )
+
+    if previous_meal_plan:
+        meal_plan_prompt += (
+            f"Consider this person's previous meal plan while generating a new plan:\n"
+            f"{json.dumps(previous_meal_plan)}\n\n"
+        )
+
+    if recent_dishes:
+        meal_plan_prompt += (
+            f"Avoid repeating these recently served dishes:\n"
+            f"{'; '.join(recent_dishes)}\n\n"
+        )
+
+    meal_plan_prompt += "**Format the response as a valid JSON array with the following structure**:\n\n[\n"
+    meal_plan_prompt += ",\n".join(
+        f"  {{ \"day\": {day}, \"breakfast\": \"Meal\", \"lunch\": \"Meal\", \"dinner\": \"Meal\" }}"
+        for day in days
+    )
+    meal_plan_prompt += "\n]"
+
+    return meal_plan_prompt
+
+
+def streamed_plan_collector():
+    """Returns feed(chunk), which parses a streamed completion and returns the
+    (email, day_entry, partial_plan) of every day completed by that chunk."""
+    parser = IncrementalPlanParser()
+    partial_plan = {}
+
+    def feed(chunk):
+        completed = []
+        for email, day_entry in parser.feed(chunk):
+            partial_plan.setdefault(email, []).append(day_entry)
+            completed.append((email, day_entry, partial_plan))
+        return completed
+
+    return feed
+
+
+def decomposed_prompts(member_restrictions, previous_meal_plans=None, recent_dishes=None):
+    """Groups members by restriction profile; returns (member index groups, one prompt per group)."""
+    previous_meal_plans = canonical_meal_plan(previous_meal_plans)
+    if not isinstance(previous_meal_plans, dict):
+        previous_meal_plans = {}
+
+    # One request per distinct restriction profile, shared by members who have the same one
+    profiles = {}
+    for i in range(1, 5):
+        profile = normalize_restrictions(member_restrictions[f"restrictions_{i}"])
+        profiles.setdefault(profile, []).append(i)
+
+    prompts = []
+    for member_indexes in profiles.values():
+        first = member_indexes[0]
+        prompts.append(generate_member_meal_plan_prompt(
+            member_restrictions[f"restrictions_{first}"],
+            previous_meal_plans.get(member_restrictions[f"email_{first}"]),
+            recent_dishes))
+    return list(profiles.values()), prompts
+
+
+def merge_member_plans(member_restrictions, member_groups, responses):
+    """Combines one completion per member group into the family's {email: plan} JSON string."""
+    member_plans = {}
+    for member_indexes, response in zip(member_groups, responses, strict=True):
+        try:
+            plan = parse_json_response(response)
+        except ValueError:
+            # Left empty for repair_meal_plan() to regenerate
+            plan = []
+        for i in member_indexes:
+            member_plans[i] = plan
+
+    meal_plan = {member_restrictions[f"email_{i}"]: member_plans[i] for i in range(1, 5)}
+    return json.dumps(meal_plan, indent=2)
+
+
+def repair_prompts(member_restrictions, validation, recent_dishes=None):
+    """One prompt per group of members with the same restrictions and the same missing days.
+
+    Returns (email groups, prompts); the member's valid dishes are added to the
+    dishes to avoid so the regenerated days do not repeat the rest of the week.
+    """
+    groups = {}
+    for email, days in validation.missing().items():
+        i = next(i for i in range(1, 5) if member_restrictions[f"email_{i}"] == email)
+        profile = normalize_restrictions(member_restrictions[f"restrictions_{i}"])
+        groups.setdefault((profile, tuple(days)), []).append((i, email))
+
+    email_groups, prompts = [], []
+    for (_, days), members in groups.items():
+        first, first_email = members[0]
+        avoid = list(recent_dishes or []) + validation.dishes(first_email)
+        email_groups.append([email for _, email in members])
+        prompts.append(generate_member_meal_plan_prompt(
+            member_restrictions[f"restrictions_{first}"], recent_dishes=avoid, days=days))
+    return email_groups, prompts
+
+
+def merge_repairs(validation, email_groups, responses):
+    for emails, response in zip(email_groups, responses, strict=True):
+        days = parse_member_response(response)
+        for email in emails:
+            wanted = set(validation.missing().get(email, ()))
+            validation.merge(email, {day: entry for day, entry in days.items() if day in wanted})
+
+
+# Rounds, request count and result of one plan repair; the sync and async paths only differ
+# in how each round's prompts are sent
+class PlanRepair:
+    def __init__(self, member_restrictions, validation, recent_dishes=None):
+        self.member_restrictions = member_restrictions
+        self.validation = validation
+        self.recent_dishes = recent_dishes
+        self.missing_days = validation.missing_count()
+        self.requests = 0
+        self.rounds = 0
+        self.email_groups = []
+
+    @classmethod
+    def for_plan(cls, member_restrictions, combined_meal_plan, recent_dishes=None):
+        validation = PlanValidation(combined_meal_plan,
+                                    [member_restrictions[f"email_{i}"] for i in range(1, 5)])
+        return cls(member_restrictions, validation, recent_dishes)
+
+    def next_prompts(self):
+        """Prompts for the next round, or None once the plan is complete or PLAN_REPAIR_ATTEMPTS rounds ran."""
+        if self.rounds >= PLAN_REPAIR_ATTEMPTS or self.validation.is_complete():
+            return None
+        self.rounds += 1
+        self.email_groups, prompts = repair_prompts(self.member_restrictions, self.validation,
+                                                    self.recent_dishes)
+        self.requests += len(prompts)
+        return prompts
+
+    def merge(self, responses):
+        merge_repairs(self.validation, self.email_groups, responses)
+
+    def finish(self):
+        """Records the outcome and returns the plan as a JSON string; raises ValueError if still incomplete."""
+        family_id = self.member_restrictions.get('family_id')
+        result = repair_stats.record(self.validation, self.missing_days, self.requests)
+        if result == "failed":
+            raise ValueError(f"OpenAI returned an incomplete meal plan for family "
+                             f"{family_id}: {json.dumps(self.validation.missing())}")
+        if result == "repaired":
+            print(f"Repaired {self.missing_days} missing member-days for family "
+                  f"{family_id} with {self.requests} request(s)")
+        return json.dumps(self.validation.to_plan(), indent=2)
+
+
+def fill_missing_days(repair):
+    """Requests what the repair's validation is missing, up to PLAN_REPAIR_ATTEMPTS rounds; returns the repair."""
+    prompts = repair.next_prompts()
+    while prompts is not None:
+        repair.merge(meal_plan_service.generate_many(prompts, max_tokens=MEMBER_MAX_TOKENS))
+        prompts = repair.next_prompts()
+    return repair
+
+
+async def afill_missing_days(repair):
+    prompts = repair.next_prompts()
+    while prompts is not None:
+        repair.merge(await meal_plan_service.agenerate_many(prompts, max_tokens=MEMBER_MAX_TOKENS))
+        prompts = repair.next_prompts()
+    return repair
+
+
+def repair_meal_plan(member_restrictions, combined_meal_plan, recent_dishes=None):
+    """Validates a family plan (4 members x 7 days x 3 meals) and regenerates only what is missing.
+
+    Truncated or partly malformed output keeps every well-formed day; the
+    missing members/days are requested with small per-member prompts and merged
+    in. Raises ValueError if the plan is still incomplete after
+    PLAN_REPAIR_ATTEMPTS rounds. Returns the plan as a JSON string.
+    """
+    repair = PlanRepair.for_plan(member_restrictions, combined_meal_plan, recent_dishes)
+    return fill_missing_days(repair).finish()
+
+
+async def arepair_meal_plan(member_restrictions, combined_meal_plan, recent_dishes=None):
+    repair = PlanRepair.for_plan(member_restrictions, combined_meal_plan, recent_dishes)
+    return (await afill_missing_days(repair)).finish()
+
+
+def generate_family_meal_plan(member_restrictions, previous_meal_plans=None, on_day=None,
+                              recent_dishes=None):
+    """Generates a family's meal plan as a JSON string keyed by email, using MEAL_PLAN_GENERATION_MODE.
+
+    In streaming mode on_day(email, day_entry, partial_plan) is called as each day completes.
+    The result is validated and any missing members or days are regenerated by repair_meal_plan().
+    """
+    if MEAL_PLAN_GENERATION_MODE == 'streaming':
+        meal_plan_prompt = generate_meal_plan_prompt(member_restrictions, previous_meal_plans,
+                                                     recent_dishes)
+        feed = streamed_plan_collector()
+        chunks = []
+        for chunk in meal_plan_service.stream_meal_plan(meal_plan_prompt):
+            chunks.append(chunk)
+            for completed_day in feed(chunk):
+                if on_day is not None:
+                    on_day(*completed_day)
+        combined_meal_plan = "".join(chunks)
+    elif MEAL_PLAN_GENERATION_MODE != 'decomposed':
+        meal_plan_prompt = generate_meal_plan_prompt(member_restrictions, previous_meal_plans,
+                                                     recent_dishes)
+        # Generate combined meal plan using OpenAI
+        combined_meal_plan = meal_plan_service.generate_meal_plan(meal_plan_prompt)
+    else:
+        member_groups, prompts = decomposed_prompts(member_restrictions, previous_meal_plans,
+                                                    recent_dishes)
+        responses = meal_plan_service.generate_many(prompts, max_tokens=MEMBER_MAX_TOKENS)
+        combined_meal_plan = merge_member_plans(member_restrictions, member_groups, responses)
+
+    return repair_meal_plan(member_restrictions, combined_meal_plan, recent_dishes)
+
+
+async def agenerate_family_meal_plan(member_restrictions, previous_meal_plans=None, on_day=None,
+                                     recent_dishes=None):
+    """generate_family_meal_plan() on the event loop; on_day runs on a worker thread since it writes files."""
+    if MEAL_PLAN_GENERATION_MODE == 'streaming':
+        meal_plan_prompt = generate_meal_plan_prompt(member_restrictions, previous_meal_plans,
+                                                     recent_dishes)
+        feed = streamed_plan_collector()
+        chunks = []
+        async for chunk in meal_plan_service.astream_meal_plan(meal_plan_prompt):
+            chunks.append(chunk)
+            for completed_day in feed(chunk):
+                if on_day is not None:
+                    await asyncio.to_thread(on_day, *completed_day)
+        combined_meal_plan = "".join(chunks)
+    elif MEAL_PLAN_GENERATION_MODE != 'decomposed':
+        meal_plan_prompt = generate_meal_plan_prompt(member_restrictions, previous_meal_plans,
+                                                     recent_dishes)
+        combined_meal_plan = await meal_plan_service.agenerate_meal_plan(meal_plan_prompt)
+    else:
+        member_groups, prompts = decomposed_prompts(member_restrictions, previous_meal_plans,
+                                                    recent_dishes)
+        responses = await meal_plan_service.agenerate_many(prompts, max_tokens=MEMBER_MAX_TOKENS)
+        combined_meal_plan = merge_member_plans(member_restrictions, member_groups, responses)
+
+    return await arepair_meal_plan(member_restrictions, combined_meal_plan, recent_dishes)
+
+
 def generate_family_id():
     return str(uuid.uuid4())
 
 
+def is_family_id(family_id):
+    """True only for ids in the form generate_family_id() makes; request values become folder names."""
+    try:
+        return str(uuid.UUID(family_id)) == family_id
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
 # Load user credentials
 def load_user_credentials():
-    try:
-        with open('data/user_credentials.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}  # Return an empty dict if the file doesn't exist
-    except json.JSONDecodeError:
-        return {}  # Return an empty dict if the file is not valid JSON
+    """Returns every account; prefer credential_store.get() for single lookups."""
+    return credential_store.load_all()
 
 
 # Save user credentials
 def save_user_credentials(credentials):
-    with open(user_credentials_file, 'w') as file:
-        json.dump(credentials, file)
-
-# Save member restrictions, for updating meals
-def save_member_restrictions(member_restrictions):
-    with open(member_restriction_file, 'w') as file:
-        json.dump(member_restrictions, file)
-        
+    credential_store.upsert_many(credentials)
+
 def generate_hashed_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'),
-                         bcrypt.gensalt()).decode('utf-8')
+    return password_hasher.hash(password)
 
 
-def send_email(recipient_email, username=None, password=None, subject="Your Login Credentials", body=None):
+def build_email(recipient_email, username=None, password=None, subject="Your Login Credentials", body=None):
     if body is None:
         body = f"Hello {username},\n\nYour account has been created successfully!\n\n" \
                f"Email: {recipient_email}\nPassword: {password}\n\n"
@@ -146,148 +515,494 @@ def send_email(recipient_email, username=None, password=None, subject="Your Logi
     msg["To"] = recipient_email
     msg["Subject"] = subject
     msg.attach(MIMEText(body, "plain"))
+    return msg
+
+
+def send_email(recipient_email, username=None, password=None, subject="Your Login Credentials", body=None):
+    """Queues an email on the outbox and returns its message id; delivery happens in the background."""
+    return outbox.send(build_email(recipient_email, username, password, subject, body))
 
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            server.send_message(msg)
-        print(f"Email sent to {recipient_email}")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
+
+def send_family_emails(emails):
+    """Queues several build_email() argument tuples as one batch so they share an SMTP connection."""
+    return outbox.send_batch([build_email(*args) for args in emails])
 
 
 def check_password(hashed_password, plain_password):
-    return bcrypt.checkpw(plain_password.encode('utf-8'),
-                          hashed_password.encode('utf-8'))
+    return password_hasher.check(hashed_password, plain_password)
 
 
 def check_existing_emails(member_restrictions):
     """Check if any of the provided emails are already registered."""
-    credentials = load_user_credentials()  # Load current credentials
+    emails = [member_restrictions[f"email_{i}"] for i in range(1, 5)]
+    existing_email = credential_store.find_existing(emails)
 
-    for i in range(1, 5):
-        email_key = f"email_{i}"
-        if member_restrictions[email_key] in credentials:
-            # If any email already exists, return False and the existing email
-            return False, member_restrictions[email_key]
+    if existing_email:
+        # If any email already exists, return False and the existing email
+        return False, existing_email
 
     return True, None
 
-# this func. will be. used in cron job
-def load_meal_plans(base_folder):
-    """Loads the meal plan (1.json) and member restrictions (member_restrictions.json) for each family directory within the base folder."""
-    # List to store all combined meal plans and member restrictions
-    meal_plans = []
-
-    # Walk through the base folder
-    for root, dirs, files in os.walk(base_folder):
-        # Initialize dictionary to store both member restrictions and meal plan
-        combined_data = {}
-
-        # Check for the presence of 1.json (meal plan) and member_restrictions.json (member restrictions)
-        if "1.json" in files and "member_restrictions.json" in files:
-            # Load meal plan (1.json)
-            meal_plan_path = os.path.join(root, "1.json")
+def family_shard(family_id, shard_count):
+    """Stable shard number for a family, the same in every process and on every node."""
+    return zlib.crc32(family_id.encode('utf-8')) % shard_count
+
+
+def iter_families(base_folder, shard_index=0, shard_count=1):
+    """Lazily yields the meal plan (1.json) and member restrictions of each family directory in the base folder.
+
+    With shard_count > 1 only families whose family_id hashes to shard_index are
+    yielded, so several processes can split the weekly run without overlap.
+    """
+    try:
+        entries = os.scandir(base_folder)
+    except FileNotFoundError:
+        return
+
+    with entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            if shard_count > 1 and family_shard(entry.name, shard_count) != shard_index:
+                continue
+
+            meal_plan_path = os.path.join(entry.path, "1.json")
+            member_restrictions_path = os.path.join(entry.path, "member_restrictions.json")
+            # Skip families that have no plan yet
+            if not (os.path.isfile(meal_plan_path) and os.path.isfile(member_restrictions_path)):
+                continue
+
             with open(meal_plan_path, 'r') as json_file:
                 meal_plan = json.load(json_file)
-                combined_data["meal_plan"] = meal_plan
+            with open(member_restrictions_path, 'r') as json_file:
+                member_restrictions = json.load(json_file)
+
+            yield {"meal_plan": meal_plan, "member_restrictions": member_restrictions}
+
+
+def load_meal_plans(base_folder):
+    """Loads every family at once; prefer iter_families() for large trees."""
+    return list(iter_families(base_folder))
+
+
+def weekly_recent_dishes(data):
+    """Dishes of the last HISTORY_CONTEXT_WEEKS (plus the current plan) the next week should avoid."""
+    # Summarize recent weeks as a list of dishes instead of sending whole previous plans
+    return meal_plan_history.recent_dishes(data['member_restrictions']['family_id'],
+                                           HISTORY_CONTEXT_WEEKS, extra_plans=[data.get('meal_plan')])
+
 
-            # Load member restrictions (member_restrictions.json)
-            member_restrictions_path = os.path.join(root, "member_restrictions.json")
+def apply_regenerated_plan(member_restrictions, combined_meal_plan, week=None):
+    """Saves a family's new weekly plan and notifies the members."""
+    # Save the combined meal plan
+    meal_plan_saver.save_meal_plan(member_restrictions['family_id'], meal_plan=combined_meal_plan,
+                                   week=week or plan_week())
+
+    send_family_emails([
+        (member_restrictions[f"email_{i}"],
+         member_restrictions[f"first_name_{i}"], None, "meal plan")
+        for i in range(1, 5)
+    ])
+
+
+def regenerate_family_meal_plan(data):
+    """Generates next week's plan for one family from load_meal_plans(), saves it and notifies the members."""
+    # Each `data` contains both 'meal_plan' and 'member_restrictions'
+    member_restrictions = data.get('member_restrictions')
+    combined_meal_plan = generate_family_meal_plan(member_restrictions,
+                                                   recent_dishes=weekly_recent_dishes(data))
+    apply_regenerated_plan(member_restrictions, combined_meal_plan)
+
+
+def create_batch_backend():
+    if BATCH_BACKEND == 'local':
+        # Each request line goes through the regular (rate limited) completions path
+        return LocalBatchBackend(
+            lambda body: meal_plan_service.generate_meal_plan(body["messages"][-1]["content"],
+                                                              body.get("max_tokens")),
+            folder='data/batches/local', max_workers=REGENERATION_CONCURRENCY)
+    return OpenAIBatchBackend(meal_plan_service.client())
+
+
+def batch_requests(families, ledger):
+    """Yields (family_id, request body) for each family not yet regenerated this week."""
+    for data in families:
+        member_restrictions = data['member_restrictions']
+        family_id = member_restrictions['family_id']
+        if ledger.is_done(family_id):
+            continue
+        prompt = generate_meal_plan_prompt(member_restrictions,
+                                           recent_dishes=weekly_recent_dishes(data))
+        yield family_id, meal_plan_service.batch_request_body(prompt)
+
+
+def batch_results(results):
+    """Turns batch result lines into RegenerationEngine items, re-reading each family's members from disk."""
+    for family_id, content, error in results:
+        member_restrictions_path = os.path.join('meal_plans', family_id, 'member_restrictions.json')
+        try:
             with open(member_restrictions_path, 'r') as json_file:
                 member_restrictions = json.load(json_file)
-                combined_data["member_restrictions"] = member_restrictions
+        except FileNotFoundError:
+            member_restrictions = {"family_id": family_id}
+            error = error or "Family no longer exists"
+        yield {"member_restrictions": member_restrictions, "meal_plan": content, "error": error}
+
+
+def regenerate_batch_family(week):
+    def apply(data):
+        if data['error']:
+            raise RuntimeError(data['error'])
+        # Incomplete batch output is patched with live per-member requests
+        combined_meal_plan = repair_meal_plan(data['member_restrictions'], data['meal_plan'])
+        apply_regenerated_plan(data['member_restrictions'], combined_meal_plan, week=week)
+    return apply
+
+
+def run_batch_regeneration(families, week, ledger, should_stop=None):
+    """Batch mode of update_meal_plan(): one Batch API request per family, keyed by family_id.
+
+    Prompts and results are streamed through JSONL files, so memory stays flat
+    however many families there are. A manifest in data/batches/ lets a new
+    leader pick up the submitted batches instead of submitting them again; a
+    batch's JSONL files are deleted once all of its families are applied.
+    """
+    folder = os.path.join('data', 'batches', regeneration_run_name().replace(':', '_'), week)
+    batch_run = BatchRun(create_batch_backend(), folder, max_requests_per_batch=BATCH_MAX_REQUESTS,
+                         poll_interval=BATCH_POLL_INTERVAL)
+    engine = RegenerationEngine(regenerate_batch_family(week), max_in_flight=REGENERATION_CONCURRENCY,
+                                checkpoint=ledger)
+    # A batch is only marked processed once every family in it has been saved and emailed
+    groups = ((batch_results(results), functools.partial(batch_run.mark_processed, batch))
+              for batch, results in batch_run.batches(batch_requests(families, ledger), should_stop))
+    report = engine.run_groups(groups, should_stop=should_stop)
+    report["stopped"] = report["stopped"] or batch_run.stopped
+    report["failed"] += batch_run.missing
+    return report
+
+
+def regeneration_run_name():
+    # Each shard runs (and finishes) its own part of the weekly run
+    return f"{REGENERATION_JOB}:shard-{REGENERATION_SHARD_INDEX}-of-{REGENERATION_SHARD_COUNT}"
 
-            # Append combined data to the list
-            meal_plans.append(combined_data)
 
-    return meal_plans
-    
 # Update meal plan at scheduled time
-def update_meal_plan():
-        """Update meal plans and print the result for each family."""
-        # Pakistan Standard Time (PKT)
-        pkt_timezone = pytz.timezone('Asia/Karachi')
+def update_meal_plan(week=None, should_stop=None):
+        """Regenerate every family's meal plan concurrently and print a summary of the run.
+
+        Families already regenerated for the week are skipped, so a repeated or
+        resumed run never generates or emails a family twice.
+        """
         current_time = dt.now(pkt_timezone)
         print(f"Scheduler triggered: Updating meal plan at {current_time}")
+        week = week or plan_week(current_time)
+        run_name = regeneration_run_name()
+        scheduler_store.start_run(run_name, week)
 
-        # Dummy logic for meal plan update (can be replaced with actual meal plan generation)
-        time.sleep(2)  # Simulate meal plan generation process
+        base_folder = 'meal_plans'
+        families = iter_families(base_folder, REGENERATION_SHARD_INDEX, REGENERATION_SHARD_COUNT)
 
-        # Example usage
-        base_folder = 'meal_plans'  # Replace with your base folder path
-        meal_plans = load_meal_plans(base_folder)
+        # Idempotency records are keyed by (job, week, family), independent of sharding
+        ledger = scheduler_store.ledger(REGENERATION_JOB, week)
+        if REGENERATION_MODE == 'batch':
+            report = run_batch_regeneration(families, week, ledger, should_stop=should_stop)
+        else:
+            engine = RegenerationEngine(regenerate_family_meal_plan,
+                                        max_in_flight=REGENERATION_CONCURRENCY,
+                                        checkpoint=ledger)
+            report = engine.run(families, should_stop=should_stop)
 
-        if meal_plans:
-            for i, data in enumerate(meal_plans, start=1):
-                # Each `data` contains both 'meal_plan' and 'member_restrictions'
-                meal_plan = data.get('meal_plan')
-                member_restrictions = data.get('member_restrictions')
-                
-                # Extract family ID from member_restrictions, assuming it's stored there
-                family_id = member_restrictions.get('family_id', f"Unknown Family {i}")
-                
-                meal_plan_prompt = generate_meal_plan_prompt(member_restrictions,meal_plan)
+        if report["stopped"]:
+            print(f"Meal plan update stopped early, another process will resume it: {json.dumps(report)}")
+            return report
+        scheduler_store.finish_run(run_name, week)
 
-                # Generate combined meal plan using OpenAI
-                combined_meal_plan = meal_plan_service.generate_meal_plan(meal_plan_prompt)
+        if report["processed"] + report["skipped"] + report["failed"] == 0:
+            print("No meal plan file found.")
+        else:
+            print(f"Meal plan update finished: {json.dumps(report)}")
+        return report
 
-                for i in range(1, 5):
-                    email_key = f"email_{i}"   
-                    send_email(member_restrictions[email_key],
-                        member_restrictions[f"first_name_{i}"], 
-                                   None, "meal plan")
 
+def scheduled_meal_plan_update():
+    # Stop handing out families as soon as this process stops being the leader
+    return update_meal_plan(should_stop=lambda: not meal_plan_scheduler.is_leader)
 
-                # Save the combined meal plan
-                file_path = meal_plan_saver.save_meal_plan(family_id,
-                                                           meal_plan=combined_meal_plan)
 
-        else:
-            print("No meal plan file found.")
+def last_scheduled_update(now=None):
+    """When the weekly run for plan_week(now) was due: the start of the latest Sunday in PKT."""
+    now = now or dt.now(pkt_timezone)
+    sunday = now - timedelta(days=(now.weekday() + 1) % 7)
+    return sunday.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def resume_meal_plan_update():
+    """Finishes this week's run if a previous leader died before the end, or starts it if it was missed.
+
+    Followers drop the Sunday job when it comes due, so if the leader died just
+    before 00:00 no process started the run.
+    """
+    now = dt.now(pkt_timezone)
+    week = plan_week(now)
+    status = scheduler_store.run_status(regeneration_run_name(), week)
+    if status == "running":
+        print(f"Resuming the unfinished meal plan update for {week}")
+        update_meal_plan(week, should_stop=lambda: not meal_plan_scheduler.is_leader)
+    elif status is None and now - last_scheduled_update(now) <= timedelta(hours=SCHEDULER_CATCH_UP_HOURS):
+        print(f"Starting the meal plan update for {week}, missed at {last_scheduled_update(now)}")
+        update_meal_plan(week, should_stop=lambda: not meal_plan_scheduler.is_leader)
+
+
+def generate_first_meal_plan(member_restrictions, on_day=None):
+    """Returns a new family's first meal plan, reusing a cached plan for the same restrictions when possible."""
+    cached_meal_plan = generation_cache.get(member_restrictions)
+    if cached_meal_plan is not None:
+        return cached_meal_plan
+
+    combined_meal_plan = generate_family_meal_plan(member_restrictions, on_day=on_day)
+    generation_cache.put(member_restrictions, combined_meal_plan)
+    return combined_meal_plan
 
 
-# Run the scheduling task in a separate thread
-def run_schedule():
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+async def agenerate_first_meal_plan(member_restrictions, on_day=None):
+    cached_meal_plan = await asyncio.to_thread(generation_cache.get, member_restrictions)
+    if cached_meal_plan is not None:
+        return cached_meal_plan
 
+    combined_meal_plan = await agenerate_family_meal_plan(member_restrictions, on_day=on_day)
+    await asyncio.to_thread(generation_cache.put, member_restrictions, combined_meal_plan)
+    return combined_meal_plan
 
-# Schedule the job to run every Sunday at 12 AM PKT
-schedule.every().sunday.at("00:00").do(update_meal_plan)
-# schedule.every(1).minutes.do(update_meal_plan)
 
-# Start the scheduler in a background thread
-threading.Thread(target=run_schedule, daemon=True).start()
+def send_new_member_credentials(payload):
+    send_family_emails([
+        (payload['member_restrictions'][f"email_{i}"],
+         payload['member_restrictions'][f"first_name_{i}"], DEFAULT_PASSWORD)
+        for i in payload['new_member_indexes']
+    ])
 
 
-@app.route('/')
+def partial_plan_path(family_id):
+    return os.path.join('meal_plans', family_id, 'partial.json')
+
+
+def partial_plan_saver(family_id):
+    """Returns an on_day callback that persists and publishes each day as soon as it is generated."""
+    def on_day(email, day_entry, partial_plan):
+        # Persist each finished day right away for streams served by other processes; it goes
+        # to partial.json so 1.json only ever holds a validated plan
+        meal_plan_saver.save_meal_plan(family_id, meal_plan=json.dumps(partial_plan, indent=2),
+                                       file_name="partial")
+        plan_stream_broker.publish(family_id, "day", {"email": email, "day": day_entry})
+    return on_day
+
+
+def discard_partial_plan(family_id):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(partial_plan_path(family_id))
+
+
+def process_new_family(job):
+    """Job handler: emails credentials to new members, then generates and saves the first meal plan."""
+    family_id = job.payload['family_id']
+    member_restrictions = job.payload['member_restrictions']
+
+    job.report_progress("sending credentials")
+    send_new_member_credentials(job.payload)
+
+    job.report_progress("generating meal plan")
+    try:
+        combined_meal_plan = generate_first_meal_plan(member_restrictions,
+                                                      on_day=partial_plan_saver(family_id))
+
+        # Save the combined meal plan
+        job.report_progress("saving meal plan")
+        file_path = meal_plan_saver.save_meal_plan(family_id,
+                                                   meal_plan=combined_meal_plan,
+                                                   week=plan_week())
+    except Exception as e:
+        plan_stream_broker.close(family_id, error=str(e))
+        raise
+    finally:
+        discard_partial_plan(family_id)
+    plan_stream_broker.close(family_id)
+
+    return {"family_id": family_id, "file_path": file_path}
+
+
+async def process_new_family_async(job):
+    """process_new_family() for the event loop: OpenAI is awaited, disk and SQLite work goes to threads."""
+    family_id = job.payload['family_id']
+    member_restrictions = job.payload['member_restrictions']
+
+    await asyncio.to_thread(job.report_progress, "sending credentials")
+    send_new_member_credentials(job.payload)
+
+    await asyncio.to_thread(job.report_progress, "generating meal plan")
+    try:
+        combined_meal_plan = await agenerate_first_meal_plan(member_restrictions,
+                                                             on_day=partial_plan_saver(family_id))
+
+        await asyncio.to_thread(job.report_progress, "saving meal plan")
+        file_path = await asyncio.to_thread(meal_plan_saver.save_meal_plan, family_id,
+                                            combined_meal_plan, None, plan_week())
+    except Exception as e:
+        plan_stream_broker.close(family_id, error=str(e))
+        raise
+    finally:
+        await asyncio.to_thread(discard_partial_plan, family_id)
+    plan_stream_broker.close(family_id)
+
+    return {"family_id": family_id, "file_path": file_path}
+
+
+def load_member_restrictions(family_id):
+    """Returns a family's stored member_restrictions.json, or None if there is no such family."""
+    member_restrictions_path = os.path.join('meal_plans', family_id, 'member_restrictions.json')
+    try:
+        with open(member_restrictions_path, 'r') as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+
+
+def changed_member_indexes(member_restrictions, updates):
+    """Applies {email: dietary restrictions} to member_restrictions; returns the indexes whose restrictions changed.
+
+    Rewording that normalizes to the same restrictions is saved but needs no new meals.
+    """
+    indexes = {}
+    for i in range(1, 5):
+        indexes.setdefault(member_restrictions[f"email_{i}"], []).append(i)
+    unknown = [email for email in updates if email not in indexes]
+    if unknown:
+        raise ValueError(f"Not a member of this family: {', '.join(unknown)}")
+
+    changed = []
+    for email, restrictions in updates.items():
+        for i in indexes[email]:
+            if normalize_restrictions(restrictions) != normalize_restrictions(
+                    member_restrictions[f"restrictions_{i}"]):
+                changed.append(i)
+            member_restrictions[f"restrictions_{i}"] = restrictions
+    return sorted(changed)
+
+
+def process_member_restrictions_update(job):
+    """Job handler: regenerates only the changed members' entries in the current plan and notifies them.
+
+    Queued under the family id, so it never overlaps the family's first-plan job
+    or another update and the plan read here is the one it replaces.
+    """
+    family_id = job.payload['family_id']
+    member_indexes = job.payload['member_indexes']
+    # Read the latest restrictions, a newer update may have landed since this job was queued
+    member_restrictions = load_member_restrictions(family_id)
+    if member_restrictions is None:
+        raise ValueError(f"Family {family_id} no longer exists.")
+    member_restrictions['family_id'] = family_id
+
+    file_path = os.path.join('meal_plans', family_id, '1.json')
+    try:
+        with open(file_path, 'r') as json_file:
+            current_plan = canonical_meal_plan(json.load(json_file))
+    except FileNotFoundError:
+        current_plan = None
+
+    job.report_progress("generating meal plan")
+    changed_emails = {member_restrictions[f"email_{i}"] for i in member_indexes}
+    if isinstance(current_plan, dict):
+        # Keep the other members' meals; the changed members come back as missing and are regenerated
+        kept = {email: days for email, days in current_plan.items() if email not in changed_emails}
+        validation = PlanValidation(kept, [member_restrictions[f"email_{i}"] for i in range(1, 5)])
+        requests_made = fill_missing_days(PlanRepair(member_restrictions, validation)).requests
+        if not validation.is_complete():
+            raise ValueError(f"OpenAI returned an incomplete meal plan for family {family_id}: "
+                             f"{json.dumps(validation.missing())}")
+        meal_plan = json.dumps(validation.to_plan(), indent=2)
+    else:
+        # The first plan is not saved yet (or is unreadable): generate the whole family
+        meal_plan = generate_family_meal_plan(member_restrictions)
+        requests_made = None
+
+    job.report_progress("saving meal plan")
+    file_path = meal_plan_saver.save_meal_plan(family_id, meal_plan=meal_plan, week=plan_week())
+
+    # Only the members whose restrictions changed get an email
+    send_family_emails([
+        (member_restrictions[f"email_{i}"], member_restrictions[f"first_name_{i}"], None, "meal plan")
+        for i in new_member_indexes_of(member_restrictions)
+        if member_restrictions[f"email_{i}"] in changed_emails
+    ])
+
+    return {"family_id": family_id, "file_path": file_path,
+            "regenerated_members": sorted(changed_emails), "openai_requests": requests_made}
+
+
+def create_job_queue():
+    jobs = JobQueue('data/jobs.db', max_workers=int(os.getenv('JOB_WORKERS', '2')),
+                    lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', '60')))
+    # Restriction updates regenerate one or two members, so they stay synchronous in both modes
+    jobs.register("member_restrictions", process_member_restrictions_update)
+    # The ASGI entry point (asgi.py) sets EXECUTION_MODE=async and drains the queue on its event loop
+    if EXECUTION_MODE == 'async':
+        jobs.register("new_family", process_new_family_async)
+    else:
+        jobs.register("new_family", process_new_family)
+    return jobs
+
+
+# Schedule the job to run every Sunday at 12 AM PKT; only the lease holder runs it
+meal_plan_scheduler.jobs.every().sunday.at("00:00", "Asia/Karachi").do(
+    meal_plan_scheduler.leader_only(scheduled_meal_plan_update))
+meal_plan_scheduler.on_elected(resume_meal_plan_update)
+
+
+def start_background_services(scheduler=None):
+    """Starts the job workers (threaded mode) and, unless RUN_SCHEDULER=0, the scheduler.
+
+    Nothing runs in the background until this is called, once per process that
+    should do background work; asgi.py calls it on startup.
+    """
+    if EXECUTION_MODE != 'async':
+        job_queue.start()
+    # Web workers can set RUN_SCHEDULER=0; any process left with it on can become the leader
+    if RUN_SCHEDULER if scheduler is None else scheduler:
+        meal_plan_scheduler.start()
+
+
+@routes.route('/')
+@track_latency
 def home():
     return "Server is running. Send a POST request to /webhook."
 
 
-@app.route('/login', methods=['POST'])
+@routes.route('/login', methods=['POST'])
+@track_latency
 @handle_errors
 def login():
     data = request.get_json()
     email = data.get('email')
     password = data.get('password')
 
-    credentials = load_user_credentials()
+    user = credential_store.get(email)
 
-    if email not in credentials:
+    if user is None:
         return jsonify({"error": "Invalid email or password"}), 401
 
-    stored_hashed_password = credentials[email]['password']
-    first_name = credentials[email]['first_name']
-    last_name = credentials[email]['last_name']
-    family_id = credentials[email]['family_id']
-    timestamp = credentials[email]['timestamp']
+    stored_hashed_password = user['password']
+    first_name = user['first_name']
+    last_name = user['last_name']
+    family_id = user['family_id']
+    timestamp = user['timestamp']
 
     if check_password(stored_hashed_password, password):
-        # Fetch all family members excluding the logged-in user
+        # Upgrade hashes made with an older cost factor while we have the plain password
+        if password_hasher.needs_rehash(stored_hashed_password):
+            credential_store.update_password(email, generate_hashed_password(password))
+
+        # Fetch the members of the caller's family from the family_id index
+        credentials = credential_store.get_family(family_id)
         family_members = [{
             "email": member_email,
             "first_name": member_info['first_name'],
@@ -309,7 +1024,20 @@ def login():
 
 
 
-@app.route('/get-meal-plan', methods=['GET'])
+def get_archived_meal_plans(family_id, first_week, last_week, email=None, day=None, meal=None,
+                            single=False):
+    """Builds a response from the family's weekly history: one plan, or {week: plan} for a range."""
+    archived = meal_plan_history.load_range(family_id, first_week, last_week)
+    if not archived:
+        return None
+    if (email, day, meal) != (None, None, None):
+        archived = {archived_week: slice_plan_index(build_plan_index(meal_plan), email, day, meal)
+                    for archived_week, meal_plan in archived.items()}
+    return CachedResponse(archived[first_week] if single else archived)
+
+
+@routes.route('/get-meal-plan', methods=['GET'])
+@track_latency
 @handle_errors
 def get_meal_plan():
     # Get the family_id from the query parameters
@@ -318,41 +1046,201 @@ def get_meal_plan():
     # Check if family_id is provided and is valid
     if family_id is None:
         return jsonify({"error": "family_id is required."}), 400
+    if not is_family_id(family_id):
+        return jsonify({"error": "family_id is not a valid family ID."}), 400
+
+    # Optional slice of the plan: one member, one day and/or one meal
+    email = request.args.get('email')
+    day = request.args.get('day')
+    meal = request.args.get('meal')
+    if day is not None and day not in {str(d) for d in range(1, 8)}:
+        return jsonify({"error": "day must be between 1 and 7."}), 400
+    if meal is not None and meal not in MEALS:
+        return jsonify({"error": f"meal must be one of: {', '.join(MEALS)}."}), 400
+
+    # Archived weeks: week=2026-W40 for one week, week=2026-W38..2026-W42 for a range
+    week = request.args.get('week')
+    if week is not None:
+        first_week, _, last_week = week.partition('..')
+        last_week = last_week or first_week
+        if not (WEEK_PATTERN.match(first_week) and WEEK_PATTERN.match(last_week)):
+            return jsonify({"error": "week must look like 2026-W42 or 2026-W40..2026-W42."}), 400
+
+    # Serve the pre-serialized plan; the file is only re-read after it changes
+    try:
+        if week is None:
+            cached_response = meal_plan_response_cache.get(family_id, email, day, meal)
+        else:
+            cached_response = get_archived_meal_plans(family_id, first_week, last_week,
+                                                      email, day, meal, single=first_week == last_week)
+    except SliceNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": f"Failed to load meal plan: {str(e)}"}), 500
 
-    # Construct the file path based on the family_id
-    file_path = os.path.join('meal_plans', family_id, '1.json')
-
-    # Check if the file exists
-    if not os.path.exists(file_path):
+    if cached_response is None:
         return jsonify(
             {"error": "Meal plan not found for the given family ID."}), 404
 
-    # Load the meal plan from the JSON file
-    try:
-        with open(file_path, 'r') as file:
-            meal_plan_content = json.load(file)
-    except Exception as e:
-        return jsonify({"error": f"Failed to load meal plan: {str(e)}"}), 500
+    if request.if_none_match.contains(cached_response.etag):
+        response = Response(status=304)
+    elif request.accept_encodings['gzip'] > 0:
+        response = Response(cached_response.gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(cached_response.body, mimetype='application/json')
 
     # Return the meal plan content to the frontend
-    return jsonify(meal_plan_content)
+    response.set_etag(cached_response.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
 
 
-@app.route('/webhook', methods=['POST'])
+def load_saved_days(file_path):
+    """Returns (email, day_entry) pairs from a saved plan, or [] if it is missing or unparseable."""
+    try:
+        with open(file_path, 'r') as file:
+            meal_plan_content = canonical_meal_plan(json.load(file))
+        return [(email, day_entry) for email, days in meal_plan_content.items()
+                for day_entry in days if isinstance(day_entry, dict)]
+    except (OSError, ValueError, AttributeError, TypeError):
+        return []
+
+
+def generation_job(family_id):
+    """Status of the family's latest first-plan job in jobs.db, shared by every process, or None."""
+    return job_queue.latest("new_family", family_id)
+
+
+def is_generating(job):
+    return job is not None and job["status"] in (QUEUED, RUNNING)
+
+
+class PlanEventStream:
+    """Turns a family's saved days and broker events into SSE messages, sending each day once.
+
+    Days come from the streamed partial.json while generating and from 1.json once
+    the plan is saved. Shared by the threaded /get-meal-plan/stream route and its
+    async twin in asgi.py.
+    """
+
+    def __init__(self, family_id, file_path):
+        self.family_id = family_id
+        self.file_paths = (partial_plan_path(family_id), file_path)
+        self.sent = set()
+        self.saved_mtime = None
+
+    def _saved_mtime(self):
+        mtimes = []
+        for file_path in self.file_paths:
+            try:
+                mtimes.append(os.stat(file_path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def saved_days(self):
+        self.saved_mtime = self._saved_mtime()
+        messages = []
+        for email, day_entry in (saved for file_path in self.file_paths
+                                 for saved in load_saved_days(file_path)):
+            key = (email, day_entry.get('day'))
+            if key not in self.sent:
+                self.sent.add(key)
+                messages.append(format_sse("day", {"email": email, "day": day_entry}))
+        return messages
+
+    def handle(self, event, data):
+        """Returns (messages, finished) for one broker event."""
+        messages = []
+        if event == "day":
+            key = (data["email"], data["day"].get('day'))
+            if key in self.sent:
+                return messages, False
+            self.sent.add(key)
+        elif event == "done":
+            # Plans that were not streamed (e.g. cache hits) arrive in one final save
+            messages.extend(self.saved_days())
+        messages.append(format_sse(event, data))
+        return messages, event in ("done", "error")
+
+    def poll(self):
+        """Returns (messages, finished) from the saved plan and the job status.
+
+        Covers generation running in another process, whose broker events never
+        reach this one: new days are read back from the saved files when they change.
+        """
+        messages = []
+        if self._saved_mtime() != self.saved_mtime:
+            messages.extend(self.saved_days())
+        job = generation_job(self.family_id)
+        if is_generating(job):
+            return messages, False
+        messages.extend(self.saved_days())
+        if job is not None and job["status"] == FAILED:
+            messages.append(format_sse("error", {"family_id": self.family_id, "error": job["error"]}))
+        else:
+            messages.append(format_sse("done", {"family_id": self.family_id}))
+        return messages, True
+
+
+@routes.route('/get-meal-plan/stream', methods=['GET'])
+@track_latency
 @handle_errors
-def webhook():
-    # data = request.get_json()
-    data = (request.data.decode('utf-8'))
+def stream_meal_plan():
+    """Server-Sent Events: sends the days saved so far, then each new day as it is generated."""
+    family_id = request.args.get('family_id')
 
-    print(f"Request Headers: {request.headers}")
-    print(f"Request Body: {data}")
-    data = json.loads(data)
+    if family_id is None:
+        return jsonify({"error": "family_id is required."}), 400
+    if not is_family_id(family_id):
+        return jsonify({"error": "family_id is not a valid family ID."}), 400
 
-    # data = json.loads(request.data.decode('utf-8'))
+    file_path = os.path.join('meal_plans', family_id, '1.json')
+    # Subscribe before reading the file so no day can slip between the two
+    subscriber = plan_stream_broker.subscribe(family_id)
+    generating = is_generating(generation_job(family_id))
 
-    timestamp = data.get('timestampt')
+    if not generating and not os.path.exists(file_path):
+        plan_stream_broker.unsubscribe(family_id, subscriber)
+        return jsonify(
+            {"error": "Meal plan not found for the given family ID."}), 404
 
-    member_restrictions = {
+    def events():
+        session = PlanEventStream(family_id, file_path)
+        try:
+            yield from session.saved_days()
+            if not generating:
+                yield format_sse("done", {"family_id": family_id})
+                return
+
+            last_sent = time.monotonic()
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=STREAM_POLL_SECONDS)
+                except queue.Empty:
+                    messages, finished = session.poll()
+                else:
+                    messages, finished = session.handle(event, data)
+                if messages:
+                    last_sent = time.monotonic()
+                    yield from messages
+                elif time.monotonic() - last_sent >= 15:
+                    last_sent = time.monotonic()
+                    yield ": keepalive\n\n"
+                if finished:
+                    return
+        finally:
+            plan_stream_broker.unsubscribe(family_id, subscriber)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def family_member_restrictions(data):
+    """Builds the stored member_restrictions record from one form submission."""
+    return {
         "email_1": data.get('email_1', ""),
         "first_name_1": data.get('first_name_1'),
         "last_name_1": data.get('last_name_1'),
@@ -371,54 +1259,321 @@ def webhook():
         "restrictions_4": data.get('dietary_restrictions_4', 'None')
     }
 
+
+def require_member_emails(member_restrictions):
+    for i in range(1, 5):
+        if not member_restrictions[f"email_{i}"]:
+            raise ValueError(f"email_{i} is required.")
+
+
+def new_member_indexes_of(member_restrictions):
+    """Index of the first member with each distinct email; only those get an account."""
+    seen = set()
+    new_member_indexes = []
+    for i in range(1, 5):
+        if member_restrictions[f"email_{i}"] not in seen:
+            seen.add(member_restrictions[f"email_{i}"])
+            new_member_indexes.append(i)
+    return new_member_indexes
+
+
+def family_accounts(member_restrictions, new_member_indexes, hashed_passwords, family_id, timestamp):
+    return {
+        member_restrictions[f"email_{i}"]: {
+            "first_name": member_restrictions[f"first_name_{i}"],
+            "last_name": member_restrictions[f"last_name_{i}"],
+            "password": hashed_password,
+            "family_id": family_id,
+            "timestamp": timestamp
+        }
+        for i, hashed_password in zip(new_member_indexes, hashed_passwords, strict=True)
+    }
+
+
+def notify_email_registered(existing_email):
+    # Send notification email to the person who submitted the form
+    send_email(
+        existing_email, "Meal Plan Submission Error",
+        f"Your email {existing_email} is already registered. "
+        "Please resubmit the form with a different email or contact support."
+    )
+
+
+def new_family_job(family_id, member_restrictions, new_member_indexes):
+    return {
+        "family_id": family_id,
+        "member_restrictions": member_restrictions,
+        "new_member_indexes": new_member_indexes
+    }
+
+
+@routes.route('/webhook', methods=['POST'])
+@track_latency
+@handle_errors
+def webhook():
+    # data = request.get_json()
+    data = (request.data.decode('utf-8'))
+
+    data = json.loads(data)
+
+    # data = json.loads(request.data.decode('utf-8'))
+
+    timestamp = data.get('timestampt')
+
+    member_restrictions = family_member_restrictions(data)
+
     # Check if any email is already registered
     email_check, existing_email = check_existing_emails(member_restrictions)
 
     if not email_check:
-        # Send notification email to the person who submitted the form
-        send_email(
-            existing_email, "Meal Plan Submission Error",
-            f"Your email {existing_email} is already registered. "
-            "Please resubmit the form with a different email or contact support."
-        )
+        notify_email_registered(existing_email)
         return jsonify({
             "error": "Email already registered",
             "email": existing_email
         }), 400
 
-    credentials = load_user_credentials()
+    require_member_emails(member_restrictions)
 
     family_id = generate_family_id()
-    for i in range(1, 5):
-        email_key = f"email_{i}"
-        if member_restrictions[email_key] not in credentials:
-            password = "random_password"
-            hashed_password = generate_hashed_password(password)
-            credentials[member_restrictions[email_key]] = {
-                "first_name": member_restrictions[f"first_name_{i}"],
-                "last_name": member_restrictions[f"last_name_{i}"],
-                "password": hashed_password,
-                "family_id": family_id,
-                "timestamp": timestamp
-            }
-            save_user_credentials(credentials)
-            send_email(member_restrictions[email_key],
-                       member_restrictions[f"first_name_{i}"], password)
+    new_member_indexes = new_member_indexes_of(member_restrictions)
+
+    # Hash every new member's password in parallel on the process pool
+    hashed_passwords = password_hasher.hash_many([DEFAULT_PASSWORD] * len(new_member_indexes))
+    new_members = family_accounts(member_restrictions, new_member_indexes, hashed_passwords,
+                                  family_id, timestamp)
+
+    # Commit the whole family in one transaction; a concurrent webhook
+    # registering the same email makes this fail instead of overwriting it
+    try:
+        credential_store.add_family(new_members)
+    except EmailAlreadyRegistered as e:
+        return jsonify({
+            "error": "Email already registered",
+            "email": e.email
+        }), 400
+
     member_restrictions['family_id'] = family_id
     meal_plan_saver.save_member_restrictions(family_id,member_restrictions)
-    meal_plan_prompt = generate_meal_plan_prompt(member_restrictions)
 
-    # Generate combined meal plan using OpenAI
-    combined_meal_plan = meal_plan_service.generate_meal_plan(meal_plan_prompt)
+    # Emails and meal plan generation run on the job workers
+    job_id = job_queue.enqueue("new_family", new_family_job(family_id, member_restrictions,
+                                                            new_member_indexes),
+                               key=family_id)
+
+    return jsonify({
+        "message": "Family registered. Meal plan generation has been queued.",
+        "family_id": family_id,
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}"
+    }), 202
+
+
+@routes.route('/webhook/batch', methods=['POST'])
+@track_latency
+@handle_errors
+def webhook_batch():
+    """Registers a JSON array of /webhook submissions at once; returns one result per family, in order.
+
+    Emails are checked against existing accounts and the rest of the batch in a
+    single lookup, every password is hashed in one parallel pass, all accounts
+    are committed in one transaction and the generation jobs are enqueued together.
+    """
+    families = json.loads(request.data.decode('utf-8'))
+    if not isinstance(families, list):
+        raise ValueError("Expected a JSON array of families.")
+    if len(families) > WEBHOOK_BATCH_MAX:
+        raise ValueError(f"At most {WEBHOOK_BATCH_MAX} families can be registered per request.")
+
+    results = [None] * len(families)
+
+    def reject(position, error, email=None):
+        results[position] = {"index": position, "status": "rejected", "error": error}
+        if email is not None:
+            results[position]["email"] = email
+
+    candidates = []
+    for position, data in enumerate(families):
+        if not isinstance(data, dict):
+            reject(position, "Expected a JSON object.")
+            continue
+        member_restrictions = family_member_restrictions(data)
+        try:
+            require_member_emails(member_restrictions)
+        except ValueError as e:
+            reject(position, str(e))
+            continue
+        candidates.append((position, data.get('timestampt'), member_restrictions))
+
+    # One lookup for every email in the batch, then a set index for the rest of the checks
+    existing = credential_store.existing_emails(
+        member_restrictions[f"email_{i}"] for _, _, member_restrictions in candidates
+        for i in range(1, 5))
+    claimed = set()
+    accepted = []
+    for position, timestamp, member_restrictions in candidates:
+        emails = [member_restrictions[f"email_{i}"] for i in range(1, 5)]
+        existing_email = next((email for email in emails if email in existing), None)
+        if existing_email is not None:
+            notify_email_registered(existing_email)
+            reject(position, "Email already registered", existing_email)
+            continue
+        repeated_email = next((email for email in emails if email in claimed), None)
+        if repeated_email is not None:
+            reject(position, "Email already used by another family in this batch", repeated_email)
+            continue
+        claimed.update(emails)
+        accepted.append((position, timestamp, member_restrictions,
+                         new_member_indexes_of(member_restrictions)))
+
+    # Hash every new member of every family in one pass over the process pool
+    hashed_passwords = iter(password_hasher.hash_many(
+        [DEFAULT_PASSWORD] * sum(len(indexes) for _, _, _, indexes in accepted)))
+    accounts = {}
+    for position, timestamp, member_restrictions, new_member_indexes in accepted:
+        member_restrictions['family_id'] = generate_family_id()
+        accounts[position] = family_accounts(
+            member_restrictions, new_member_indexes,
+            [next(hashed_passwords) for _ in new_member_indexes],
+            member_restrictions['family_id'], timestamp)
+
+    # Commit every account in one transaction; if a concurrent webhook took one of
+    # the emails meanwhile, drop that family and commit the rest
+    while accounts:
+        try:
+            credential_store.add_family({email: record for members in accounts.values()
+                                         for email, record in members.items()})
+            break
+        except EmailAlreadyRegistered as e:
+            position = next(position for position, members in accounts.items() if e.email in members)
+            del accounts[position]
+            reject(position, "Email already registered", e.email)
+
+    accepted = [family for family in accepted if family[0] in accounts]
+    for _, _, member_restrictions, _ in accepted:
+        meal_plan_saver.save_member_restrictions(member_restrictions['family_id'], member_restrictions)
+
+    # Keyed by family id so later restriction updates wait for each family's first plan
+    job_ids = job_queue.enqueue_many("new_family", [
+        new_family_job(member_restrictions['family_id'], member_restrictions, new_member_indexes)
+        for _, _, member_restrictions, new_member_indexes in accepted
+    ], keys=[member_restrictions['family_id'] for _, _, member_restrictions, _ in accepted]
+    ) if accepted else []
+
+    for (position, _, member_restrictions, _), job_id in zip(accepted, job_ids, strict=True):
+        results[position] = {
+            "index": position,
+            "status": "queued",
+            "family_id": member_restrictions['family_id'],
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}"
+        }
+
+    return jsonify({
+        "message": f"{len(accepted)} of {len(families)} families registered. "
+                   "Meal plan generation has been queued.",
+        "accepted": len(accepted),
+        "rejected": len(families) - len(accepted),
+        "results": results
+    }), 202 if accepted or not families else 400
+
+
+@routes.route('/member-restrictions', methods=['POST'])
+@track_latency
+@handle_errors
+def update_member_restrictions():
+    """Updates members' dietary restrictions: {"family_id": ..., "members": {email: restrictions}}.
+
+    Only members whose restrictions actually changed get new meals, on a
+    background job; the rest of the family's plan is kept as is.
+    """
+    data = request.get_json()
+    family_id = data.get('family_id')
+    updates = data.get('members')
+    if not family_id or not isinstance(updates, dict) or not updates:
+        raise ValueError("family_id and members ({email: dietary restrictions}) are required.")
+    if not is_family_id(family_id):
+        raise ValueError("family_id is not a valid family ID.")
+
+    member_restrictions = load_member_restrictions(family_id)
+    if member_restrictions is None:
+        return jsonify({"error": "Family not found for the given family ID."}), 404
+
+    changed = changed_member_indexes(member_restrictions, updates)
+    meal_plan_saver.save_member_restrictions(family_id, member_restrictions)
+
+    if not changed:
+        return jsonify({
+            "message": "Restrictions saved. No member's restrictions changed, so the meal plan is unchanged.",
+            "family_id": family_id,
+            "changed_members": []
+        }), 200
+
+    # Keyed by family: runs after the family's first plan and any earlier update are saved,
+    # so it always merges its members into the latest plan
+    job_id = job_queue.enqueue("member_restrictions", {
+        "family_id": family_id,
+        "member_indexes": changed
+    }, key=family_id)
+    return jsonify({
+        "message": "Restrictions saved. New meals for the changed members have been queued.",
+        "family_id": family_id,
+        "changed_members": sorted({member_restrictions[f"email_{i}"] for i in changed}),
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}"
+    }), 202
+
+
+@routes.route('/generation-cache/stats', methods=['GET'])
+@track_latency
+@handle_errors
+def get_generation_cache_stats():
+    return jsonify(generation_cache.stats()), 200
+
+
+@routes.route('/plan-repairs/stats', methods=['GET'])
+@track_latency
+@handle_errors
+def get_plan_repair_stats():
+    return jsonify(repair_stats.stats()), 200
+
+
+@routes.route('/jobs/<job_id>', methods=['GET'])
+@track_latency
+@handle_errors
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job), 200
+
+
+@routes.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.REGISTRY.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
+def create_app(start_background=False):
+    """Builds the Flask app. Pass start_background=True to also start the job workers and scheduler:
+
+        gunicorn 'main:create_app(start_background=True)'
+    """
+    flask_app = Flask(__name__)
+    CORS(flask_app)
+    flask_app.register_blueprint(routes)
+    if start_background:
+        start_background_services()
+    return flask_app
 
-    
-    # Save the combined meal plan
-    file_path = meal_plan_saver.save_meal_plan(family_id,
-                                               meal_plan=combined_meal_plan)
 
-    return jsonify({"message":
-                    f"Combined meal plan saved to {file_path}"}), 200
+# Importing this module only builds the app; background work starts explicitly
+app = create_app()
 
 
 if __name__ == '__main__':
+    if '--scheduler-only' in sys.argv:
+        # Standalone scheduler (and job worker) process for deployments whose web workers run without it
+        start_background_services(scheduler=True)
+        while True:
+            time.sleep(3600)
+    start_background_services()
     app.run(host='0.0.0.0', port=3000)
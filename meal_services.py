@@ -1,54 +1,280 @@
+import asyncio
 import json
-import os 
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from rate_limiter import estimate_tokens
+
+OPENAI_REQUEST_SECONDS = metrics.histogram(
+    "meal_planner_openai_request_seconds", "OpenAI chat completion latency, to the last streamed token",
+    ("mode",))
+RATE_LIMIT_WAIT_SECONDS = metrics.histogram(
+    "meal_planner_openai_rate_limit_wait_seconds", "Time spent waiting for the OpenAI rate limit budget")
+OPENAI_TOKENS = metrics.counter(
+    "meal_planner_openai_tokens_total", "Tokens reported in OpenAI usage", ("type",))
+PLAN_SAVE_SECONDS = metrics.histogram(
+    "meal_planner_plan_save_seconds", "Time to write a meal plan, its index and history archive")
+
+
+def record_usage(usage):
+    """Adds the prompt and completion token counts from an OpenAI usage object."""
+    if usage is None:
+        return
+    OPENAI_TOKENS.labels("prompt").inc(usage.prompt_tokens or 0)
+    OPENAI_TOKENS.labels("completion").inc(usage.completion_tokens or 0)
 
-import openai
 
 # Service layer for handling meal plan generation
 class MealPlanService:
-    def __init__(self, api_key):
-        if not api_key:
+    def __init__(self, api_key, rate_limiter=None, max_tokens=4096):
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter
+        self.max_tokens = max_tokens
+        self._client = None
+        self._async_client = None
+        self._client_lock = threading.Lock()
+
+    @staticmethod
+    def _messages(prompt):
+        return [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _require_api_key(self):
+        # Checked on the first request rather than at import, so the app can load without a key
+        if not self.api_key:
             raise ValueError("API key is missing. Please set your OpenAI API key.")
-        openai.api_key = api_key
 
-    def generate_meal_plan(self, prompt):
+    def client(self):
+        # One shared client, created under a lock: openai's module-level client is built
+        # lazily without one, and concurrent first calls could close each other's streams.
+        # openai itself is a slow import, so it is only loaded here.
+        self._require_api_key()
+        with self._client_lock:
+            if self._client is None:
+                import openai
+                self._client = openai.OpenAI(api_key=self.api_key)
+            return self._client
+
+    def async_client(self):
+        """The non-blocking OpenAI client used by the a* methods, created on first use."""
+        self._require_api_key()
+        with self._client_lock:
+            if self._async_client is None:
+                import openai
+                self._async_client = openai.AsyncOpenAI(api_key=self.api_key)
+            return self._async_client
+
+    def generate_meal_plan(self, prompt, max_tokens=None):
+        max_tokens = max_tokens or self.max_tokens
+
+        # Wait for room under the shared requests/tokens per minute budget
+        self._wait_for_budget(prompt, max_tokens)
 
         # Make the OpenAI API call
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=4096  # You can adjust the token limit based on your needs
-        )
+        with OPENAI_REQUEST_SECONDS.labels("complete").time():
+            response = self.client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._messages(prompt),
+                max_tokens=max_tokens  # You can adjust the token limit based on your needs
+            )
+        record_usage(response.usage)
+
+        return response.choices[0].message.content
+
+    def batch_request_body(self, prompt, max_tokens=None):
+        """The chat completion request generate_meal_plan() would send, for a Batch API input line."""
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": self._messages(prompt),
+            "max_tokens": max_tokens or self.max_tokens
+        }
+
+    def _wait_for_budget(self, prompt, max_tokens):
+        if self.rate_limiter is not None:
+            with RATE_LIMIT_WAIT_SECONDS.time():
+                self.rate_limiter.acquire(estimate_tokens(prompt, max_tokens))
+
+    def stream_meal_plan(self, prompt, max_tokens=None):
+        """Yields the completion text piece by piece as OpenAI streams it."""
+        max_tokens = max_tokens or self.max_tokens
+
+        self._wait_for_budget(prompt, max_tokens)
+
+        with OPENAI_REQUEST_SECONDS.labels("stream").time():
+            stream = self.client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._messages(prompt),
+                max_tokens=max_tokens,
+                stream=True,
+                # Ask for a final chunk carrying the usage, which streams omit by default
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    def generate_many(self, prompts, max_tokens=None, max_workers=4):
+        """Runs several independent prompts concurrently; results come back in prompt order."""
+        if len(prompts) == 1:
+            return [self.generate_meal_plan(prompts[0], max_tokens)]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as executor:
+            return list(executor.map(lambda prompt: self.generate_meal_plan(prompt, max_tokens), prompts))
+
+    # Async variants: the same requests on the event loop, so a waiting completion holds no thread
+
+    async def _wait_for_budget_async(self, prompt, max_tokens):
+        if self.rate_limiter is not None:
+            with RATE_LIMIT_WAIT_SECONDS.time():
+                await self.rate_limiter.acquire_async(estimate_tokens(prompt, max_tokens))
+
+    async def agenerate_meal_plan(self, prompt, max_tokens=None):
+        max_tokens = max_tokens or self.max_tokens
+        await self._wait_for_budget_async(prompt, max_tokens)
+
+        with OPENAI_REQUEST_SECONDS.labels("complete").time():
+            response = await self.async_client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._messages(prompt),
+                max_tokens=max_tokens
+            )
+        record_usage(response.usage)
 
         return response.choices[0].message.content
 
+    async def astream_meal_plan(self, prompt, max_tokens=None):
+        """Async generator over the completion text as OpenAI streams it."""
+        max_tokens = max_tokens or self.max_tokens
+        await self._wait_for_budget_async(prompt, max_tokens)
+
+        with OPENAI_REQUEST_SECONDS.labels("stream").time():
+            stream = await self.async_client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._messages(prompt),
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def agenerate_many(self, prompts, max_tokens=None):
+        """Runs several independent prompts concurrently on the event loop; results come back in prompt order."""
+        return list(await asyncio.gather(*(self.agenerate_meal_plan(prompt, max_tokens)
+                                           for prompt in prompts)))
+
+
+def parse_json_response(text):
+    """Parses JSON from a completion, tolerating a surrounding Markdown code fence."""
+    text = text.strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    return json.loads(text)
+
+
+def canonical_meal_plan(meal_plan):
+    """Returns a plan as parsed JSON; legacy plans stored as a raw completion string are parsed when possible."""
+    if isinstance(meal_plan, str):
+        try:
+            return parse_json_response(meal_plan)
+        except ValueError:
+            return meal_plan
+    return meal_plan
+
+
+MEALS = ("breakfast", "lunch", "dinner")
+
+
+def writer_temp_path(path):
+    """Temporary file beside `path` for write-then-replace, unique to this process and thread.
+
+    Saves for the same family can overlap (streaming, the weekly run, restriction
+    jobs), so a shared "<path>.tmp" would let one writer rename another's file.
+    """
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def build_plan_index(meal_plan):
+    """Indexes a {email: [day entries]} plan as {email: {day: {meal: dish}}} for direct slice lookups."""
+    index = {}
+    if not isinstance(meal_plan, dict):
+        return index
+    for email, days in meal_plan.items():
+        member_index = index.setdefault(email, {})
+        if not isinstance(days, list):
+            continue
+        for day_entry in days:
+            if isinstance(day_entry, dict) and 'day' in day_entry:
+                member_index[str(day_entry['day'])] = {
+                    meal: day_entry[meal] for meal in MEALS if meal in day_entry}
+    return index
+
 
 # Service layer for saving meal plans to JSON
 class MealPlanSaver:
-    def __init__(self, base_folder="meal_plans"):
+    def __init__(self, base_folder="meal_plans", history=None):
         self.base_folder = base_folder
+        self.history = history
+        self._save_listeners = []
+
+    def add_save_listener(self, listener):
+        """Registers listener(family_id, file_path), called after every saved meal plan."""
+        self._save_listeners.append(listener)
 
-    def save_meal_plan(self, family_id, meal_plan, file_name=None):
-        """Saves the meal plan to a .json file under a folder named by the family id."""
+    def save_meal_plan(self, family_id, meal_plan, file_name=None, week=None):
+        """Saves the meal plan to a .json file under a folder named by the family id.
+
+        When a week label is given the plan is also archived in the family's history.
+        """
+        with PLAN_SAVE_SECONDS.time():
+            file_path = self._write_meal_plan(family_id, meal_plan, file_name, week)
+
+        for listener in self._save_listeners:
+            listener(family_id, file_path)
+        return file_path
+
+    def _write_meal_plan(self, family_id, meal_plan, file_name, week):
         try:
             # Create the folder path based on the family ID
             folder_path = os.path.join(self.base_folder, family_id)
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path)
+            os.makedirs(folder_path, exist_ok=True)
 
             # Use the provided file_name or default to "1.json"
-            file_name = "1"
+            file_name = file_name or "1"
             file_path = os.path.join(folder_path, f"{file_name}.json")
 
-            # Save the meal plan to the file
-            with open(file_path, 'w') as json_file:
+            # Store parsed JSON so readers do not have to decode a string inside JSON;
+            # write to a temporary file and swap it in so they never see a partial plan
+            meal_plan = canonical_meal_plan(meal_plan)
+            tmp_path = writer_temp_path(file_path)
+            with open(tmp_path, 'w') as json_file:
                 json.dump(meal_plan, json_file, indent=4)
+            os.replace(tmp_path, file_path)
 
-            return file_path
+            # Precompute the (email, day, meal) index used to serve slices of the current plan
+            if file_name == "1":
+                index_path = os.path.join(folder_path, "index.json")
+                tmp_path = writer_temp_path(index_path)
+                with open(tmp_path, 'w') as json_file:
+                    json.dump({"family_id": family_id, "members": build_plan_index(meal_plan)},
+                              json_file)
+                os.replace(tmp_path, index_path)
+
+            if week is not None and self.history is not None:
+                self.history.archive(family_id, week, meal_plan)
         except Exception as e:
             raise IOError(f"Failed to save meal plan: {e}")
+        return file_path
 
 
     def save_member_restrictions(self, family_id, meal_plan, file_name=None):
@@ -56,16 +282,17 @@ class MealPlanSaver:
         try:
             # Create the folder path based on the family ID
             folder_path = os.path.join(self.base_folder, family_id)
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path)
+            os.makedirs(folder_path, exist_ok=True)
 
             # Use the provided file_name or default to "1.json"
             file_name = "member_restrictions"
             file_path = os.path.join(folder_path, f"{file_name}.json")
 
-            # Save the meal plan to the file
-            with open(file_path, 'w') as json_file:
+            # Swap in a complete file; the weekly run and update jobs may be reading it
+            tmp_path = writer_temp_path(file_path)
+            with open(tmp_path, 'w') as json_file:
                 json.dump(meal_plan, json_file, indent=4)
+            os.replace(tmp_path, file_path)
 
             return file_path
         except Exception as e:
@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+COST_PATTERN = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+
+# bcrypt is imported inside the pool workers, on first use, so loading the app stays cheap
+def _hash_password(password, rounds):
+    import bcrypt
+
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(hashed_password, plain_password):
+    import bcrypt
+
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+PASSWORD_SECONDS = metrics.histogram(
+    "meal_planner_password_seconds", "bcrypt wall time including the wait for a pool worker",
+    ("operation",))
+
+
+# Runs bcrypt in a pool of worker processes so hashing never ties up a request thread's core
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=None):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Started on first use so importing the app does not fork worker processes. By then
+        # the outbox, job and scheduler threads are running, and forking a multi-threaded
+        # process can deadlock the child, so workers come from a forkserver instead
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+            return self._executor
+
+    def _submit(self, fn, *args):
+        try:
+            return self._pool().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool and retry once
+            with self._lock:
+                self._executor = None
+            return self._pool().submit(fn, *args)
+
+    def hash(self, password):
+        with PASSWORD_SECONDS.labels("hash").time():
+            return self._submit(_hash_password, password, self.rounds).result()
+
+    def hash_many(self, passwords):
+        """Hashes several passwords in parallel across the pool, each with its own salt."""
+        with PASSWORD_SECONDS.labels("hash_many").time():
+            futures = [self._submit(_hash_password, password, self.rounds) for password in passwords]
+            return [future.result() for future in futures]
+
+    def check(self, hashed_password, plain_password):
+        with PASSWORD_SECONDS.labels("check").time():
+            return self._submit(_check_password, hashed_password, plain_password).result()
+
+    def needs_rehash(self, hashed_password):
+        """True when a stored hash was made with a different cost factor than the configured one."""
+        match = COST_PATTERN.match(hashed_password or "")
+        return match is not None and int(match.group(1)) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
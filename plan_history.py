@@ -0,0 +1,116 @@
+import gzip
+import json
+import os
+import re
+import threading
+from datetime import datetime as dt
+from datetime import timedelta
+
+import pytz
+
+from meal_services import MEALS, canonical_meal_plan, writer_temp_path
+
+WEEK_PATTERN = re.compile(r"^\d{4}-W\d{2}$")
+pkt_timezone = pytz.timezone('Asia/Karachi')
+
+
+def plan_week(when=None):
+    """ISO week label ("2026-W42") a plan generated at `when` belongs to.
+
+    The weekly run fires at the very start of Sunday, so a plan is labelled
+    with the week that starts on the following day.
+    """
+    when = when or dt.now(pkt_timezone)
+    year, week, _ = (when + timedelta(days=1)).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def dishes_in_plan(meal_plan):
+    """Returns the distinct dishes of a {email: [day entries]} plan in first-seen order."""
+    dishes = {}
+    if not isinstance(meal_plan, dict):
+        return []
+    for days in meal_plan.values():
+        if not isinstance(days, list):
+            continue
+        for day_entry in days:
+            if not isinstance(day_entry, dict):
+                continue
+            for meal in MEALS:
+                dish = day_entry.get(meal)
+                if isinstance(dish, str) and dish.strip():
+                    dishes.setdefault(dish.strip().lower(), dish.strip())
+    return list(dishes.values())
+
+
+# Weekly archive of each family's plans: gzipped compact JSON plus a small manifest
+class MealPlanHistory:
+    def __init__(self, base_folder="meal_plans"):
+        self.base_folder = base_folder
+        self._lock = threading.Lock()
+
+    def _folder(self, family_id):
+        return os.path.join(self.base_folder, family_id, "history")
+
+    def load_manifest(self, family_id):
+        """Returns the family's archived weeks, oldest first."""
+        try:
+            with open(os.path.join(self._folder(family_id), "manifest.json"), 'r') as f:
+                return json.load(f)["weeks"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return []
+
+    def archive(self, family_id, week, meal_plan):
+        """Stores a plan as the family's plan for `week`, replacing any earlier one."""
+        if not WEEK_PATTERN.match(week):
+            raise ValueError(f"Invalid week: {week}")
+        folder = self._folder(family_id)
+        os.makedirs(folder, exist_ok=True)
+
+        file_name = f"{week}.json.gz"
+        body = gzip.compress(json.dumps(canonical_meal_plan(meal_plan),
+                                        separators=(',', ':')).encode('utf-8'))
+        tmp_path = writer_temp_path(os.path.join(folder, file_name))
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, os.path.join(folder, file_name))
+
+        with self._lock:
+            weeks = [entry for entry in self.load_manifest(family_id) if entry["week"] != week]
+            weeks.append({"week": week, "file": file_name, "bytes": len(body),
+                          "saved_at": dt.now(pytz.utc).isoformat()})
+            weeks.sort(key=lambda entry: entry["week"])
+            manifest_path = os.path.join(folder, "manifest.json")
+            tmp_path = writer_temp_path(manifest_path)
+            with open(tmp_path, 'w') as f:
+                json.dump({"weeks": weeks}, f)
+            os.replace(tmp_path, manifest_path)
+
+    def load_week(self, family_id, week):
+        """Returns the plan archived for `week`, or None."""
+        for entry in self.load_manifest(family_id):
+            if entry["week"] == week:
+                with gzip.open(os.path.join(self._folder(family_id), entry["file"]), 'rt') as f:
+                    return json.load(f)
+        return None
+
+    def load_range(self, family_id, first_week, last_week):
+        """Returns {week: plan} for every archived week between the two labels, inclusive."""
+        plans = {}
+        for entry in self.load_manifest(family_id):
+            if first_week <= entry["week"] <= last_week:
+                with gzip.open(os.path.join(self._folder(family_id), entry["file"]), 'rt') as f:
+                    plans[entry["week"]] = json.load(f)
+        return plans
+
+    def recent_dishes(self, family_id, weeks=2, extra_plans=()):
+        """Distinct dishes from the last `weeks` archived plans (plus any extra plans), newest first."""
+        plans = list(extra_plans)
+        for entry in reversed(self.load_manifest(family_id)[-weeks:] if weeks else []):
+            plans.append(self.load_week(family_id, entry["week"]))
+
+        dishes = {}
+        for meal_plan in plans:
+            for dish in dishes_in_plan(canonical_meal_plan(meal_plan)):
+                dishes.setdefault(dish.lower(), dish)
+        return list(dishes.values())
@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import json
+import queue
+import threading
+
+
+class IncrementalPlanParser:
+    """Parses a streamed {email: [{day...}, ...]} completion and returns each day as soon as it closes.
+
+    Only the nesting depth, string state and the current member key are tracked,
+    so feeding the whole completion costs a single pass over its characters.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_chars = []
+        self.last_string = None
+        self.current_key = None
+        self.capture = None
+
+    def feed(self, text):
+        """Consumes a chunk of completion text; returns a list of (email, day_entry) pairs completed by it."""
+        completed = []
+        for char in text:
+            if self.capture is not None:
+                self.capture.append(char)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = json.loads('"' + "".join(self.string_chars) + '"')
+                    continue
+                if self.depth == 1:
+                    self.string_chars.append(char)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_chars = []
+            elif char == ':' and self.depth == 1:
+                self.current_key = self.last_string
+            elif char in '{[':
+                self.depth += 1
+                if char == '{' and self.depth == 3 and self.current_key is not None:
+                    self.capture = [char]
+            elif char in '}]':
+                if char == '}' and self.depth == 3 and self.capture is not None:
+                    # Malformed day; leave it for validation to catch
+                    with contextlib.suppress(ValueError):
+                        completed.append((self.current_key, json.loads("".join(self.capture))))
+                    self.capture = None
+                self.depth = max(self.depth - 1, 0)
+        return completed
+
+
+class AsyncSubscriber:
+    """Subscriber read from an event loop; publish() may be called from any thread."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+# In-process fan-out of streamed days to Server-Sent Events subscribers. Only reaches
+# subscribers in the process running the job; whether a plan is still being generated
+# is read from the job queue.
+class PlanStreamBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, family_id, loop=None):
+        """Returns a queue of (event, data); pass the running loop to get an AsyncSubscriber."""
+        subscriber = queue.Queue() if loop is None else AsyncSubscriber(loop)
+        with self._lock:
+            self._subscribers.setdefault(family_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, family_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(family_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[family_id]
+
+    def publish(self, family_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(family_id, ()))
+        for subscriber in subscribers:
+            subscriber.put((event, data))
+
+    def close(self, family_id, error=None):
+        """Ends a family's stream, telling subscribers whether generation succeeded."""
+        if error is None:
+            self.publish(family_id, "done", {"family_id": family_id})
+        else:
+            self.publish(family_id, "error", {"family_id": family_id, "error": error})
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,152 @@
+import threading
+
+import metrics
+from meal_services import MEALS, parse_json_response
+from plan_stream import IncrementalPlanParser
+
+DAYS = tuple(range(1, 8))
+
+PLAN_VALIDATIONS = metrics.counter(
+    "meal_planner_plan_validations_total", "Generated plans checked against the expected structure",
+    ("result",))
+REPAIRED_DAYS = metrics.counter(
+    "meal_planner_plan_repaired_days_total", "Member days regenerated to fix incomplete plans")
+
+
+def valid_day(entry):
+    """Returns the day number of a well-formed {"day", "breakfast", "lunch", "dinner"} entry, else None."""
+    if not isinstance(entry, dict):
+        return None
+    try:
+        day = int(entry.get('day'))
+    except (TypeError, ValueError):
+        return None
+    if day not in DAYS:
+        return None
+    for meal in MEALS:
+        if not isinstance(entry.get(meal), str) or not entry[meal].strip():
+            return None
+    return day
+
+
+def member_days(days):
+    """Maps day number to entry for the well-formed entries of one member; the first entry per day wins."""
+    valid = {}
+    if isinstance(days, list):
+        for entry in days:
+            day = valid_day(entry)
+            if day is not None and day not in valid:
+                valid[day] = dict(entry, day=day)
+    return valid
+
+
+def parse_plan(meal_plan):
+    """Parses a completion (or an already parsed plan); returns (plan, salvaged).
+
+    Output cut off mid-way (e.g. at max_tokens) is not valid JSON; in that case
+    every day that was fully written is recovered and salvaged is True.
+    """
+    if not isinstance(meal_plan, str):
+        return meal_plan, False
+    try:
+        return parse_json_response(meal_plan), False
+    except ValueError:
+        pass
+    plan = {}
+    for email, day_entry in IncrementalPlanParser().feed(meal_plan):
+        plan.setdefault(email, []).append(day_entry)
+    return plan, True
+
+
+def parse_member_response(response):
+    """Parses a single member's completion ([day entries] or {email: [day entries]}) into {day: entry}."""
+    try:
+        days = parse_json_response(response)
+    except ValueError:
+        return {}
+    if isinstance(days, dict) and len(days) == 1:
+        days = next(iter(days.values()))
+    return member_days(days)
+
+
+# Which members and days of a family plan are usable and which are missing or malformed
+class PlanValidation:
+    def __init__(self, meal_plan, emails):
+        self.emails = list(emails)
+        plan, self.salvaged = parse_plan(meal_plan)
+        if not isinstance(plan, dict):
+            plan = {}
+        # Models sometimes change the case of the email keys
+        by_email = {str(key).strip().lower(): days for key, days in plan.items()}
+        self.days = {email: member_days(by_email.get(email.strip().lower())) for email in self.emails}
+
+    def missing(self):
+        """{email: [day numbers]} for every member with days to regenerate."""
+        missing = {}
+        for email in self.emails:
+            days = [day for day in DAYS if day not in self.days[email]]
+            if days:
+                missing[email] = days
+        return missing
+
+    def missing_count(self):
+        return sum(len(days) for days in self.missing().values())
+
+    def is_complete(self):
+        return not self.missing()
+
+    def merge(self, email, days):
+        """Adds regenerated {day: entry} for a member, keeping the days already valid."""
+        for day, entry in days.items():
+            self.days[email].setdefault(day, entry)
+
+    def dishes(self, email):
+        return [entry[meal] for _, entry in sorted(self.days[email].items()) for meal in MEALS]
+
+    def to_plan(self):
+        return {email: [self.days[email][day] for day in DAYS if day in self.days[email]]
+                for email in self.emails}
+
+
+# Running totals of plan validation and repair, served by /plan-repairs/stats
+class RepairStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.valid = 0
+        self.repaired = 0
+        self.failed = 0
+        self.salvaged = 0
+        self.missing_days = 0
+        self.repaired_days = 0
+        self.repair_requests = 0
+
+    def record(self, validation, missing_days, repair_requests):
+        if validation.is_complete():
+            result = "valid" if not missing_days else "repaired"
+        else:
+            result = "failed"
+        repaired_days = missing_days - validation.missing_count()
+        with self._lock:
+            self.checked += 1
+            setattr(self, result, getattr(self, result) + 1)
+            self.salvaged += validation.salvaged
+            self.missing_days += missing_days
+            self.repaired_days += repaired_days
+            self.repair_requests += repair_requests
+        PLAN_VALIDATIONS.labels(result).inc()
+        REPAIRED_DAYS.inc(repaired_days)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "valid": self.valid,
+                "repaired": self.repaired,
+                "failed": self.failed,
+                "salvaged_truncated": self.salvaged,
+                "missing_member_days": self.missing_days,
+                "repaired_member_days": self.repaired_days,
+                "repair_requests": self.repair_requests,
+            }
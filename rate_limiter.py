@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """Blocks callers so requests-per-minute and tokens-per-minute budgets are never exceeded.
+
+    Both budgets are token buckets that refill continuously; a limit of None disables it.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute,
+                                 self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute,
+                               self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _reserve(self, tokens):
+        """Takes one request costing `tokens` if it fits now; otherwise returns the seconds to wait."""
+        if self.tokens_per_minute:
+            # A single oversized request can never fit; let it through once the bucket is full
+            tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = 0.0
+            if self.requests_per_minute and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+            if wait == 0.0:
+                if self.requests_per_minute:
+                    self._requests -= 1
+                if self.tokens_per_minute:
+                    self._tokens -= tokens
+            return wait
+
+    def acquire(self, tokens=0):
+        """Waits until one request costing `tokens` fits within both budgets."""
+        while True:
+            wait = self._reserve(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """Like acquire(), but waits on the event loop instead of blocking the thread."""
+        while True:
+            wait = self._reserve(tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
+
+
+def estimate_tokens(prompt, max_tokens=0):
+    """Rough token cost of a chat request: ~4 characters per prompt token plus the completion cap."""
+    return len(prompt) // 4 + max_tokens
@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+FAMILY_SECONDS = metrics.histogram(
+    "meal_planner_family_regeneration_seconds", "Time to regenerate one family in a weekly run")
+FAMILIES_REGENERATED = metrics.counter(
+    "meal_planner_regenerated_families_total", "Families handled by weekly runs", ("status",))
+
+
+# Runs a per-family job over many families with a bounded number in flight
+class RegenerationEngine:
+    def __init__(self, process_family, max_in_flight=8, checkpoint=None, max_reported_failures=50):
+        self.process_family = process_family
+        self.max_in_flight = max_in_flight
+        self.checkpoint = checkpoint
+        self.max_reported_failures = max_reported_failures
+
+    @staticmethod
+    def family_id_of(data):
+        return data['member_restrictions'].get('family_id')
+
+    def _process_timed(self, data):
+        with FAMILY_SECONDS.time():
+            return self.process_family(data)
+
+    def run(self, families, should_stop=None):
+        """Processes every family not already checkpointed and returns a summary report.
+
+        When should_stop() turns true no further families are started; the report
+        then has "stopped" set and the rest are left for a later run.
+        """
+        return self.run_groups([(families, None)], should_stop=should_stop)
+
+    def run_groups(self, groups, should_stop=None):
+        """Like run() over (families, on_done) pairs, e.g. one per result batch.
+
+        Every family of a group has finished (saved or failed) before on_done()
+        is called and the next group is pulled. on_done is not called for a
+        group cut short by should_stop.
+        """
+        started = time.monotonic()
+        report = {"processed": 0, "skipped": 0, "failed": 0, "failures": [], "stopped": False}
+
+        def collect(future, family_id):
+            try:
+                future.result()
+            except Exception as e:
+                report["failed"] += 1
+                if len(report["failures"]) < self.max_reported_failures:
+                    report["failures"].append({"family_id": family_id, "error": str(e)})
+                print(f"Failed to update meal plan for family {family_id}: {e}")
+                FAMILIES_REGENERATED.labels("failed").inc()
+            else:
+                report["processed"] += 1
+                FAMILIES_REGENERATED.labels("processed").inc()
+                if self.checkpoint is not None and family_id:
+                    self.checkpoint.mark_done(family_id)
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            pending = {}
+            for families, on_done in groups:
+                for data in families:
+                    if should_stop is not None and should_stop():
+                        report["stopped"] = True
+                        break
+                    family_id = self.family_id_of(data)
+                    if self.checkpoint is not None and self.checkpoint.is_done(family_id):
+                        report["skipped"] += 1
+                        FAMILIES_REGENERATED.labels("skipped").inc()
+                        continue
+                    # Only pull the next family once a slot frees up
+                    if len(pending) >= self.max_in_flight:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future, pending.pop(future))
+                    pending[executor.submit(self._process_timed, data)] = family_id
+
+                for future in list(pending):
+                    collect(future, pending.pop(future))
+                if report["stopped"]:
+                    break
+                if on_done is not None:
+                    on_done()
+
+        elapsed = time.monotonic() - started
+        report["elapsed_seconds"] = round(elapsed, 3)
+        report["families_per_minute"] = round(report["processed"] * 60 / elapsed, 2) if elapsed else 0.0
+        return report
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from meal_services import MEALS, build_plan_index, canonical_meal_plan
+
+
+class SliceNotFound(LookupError):
+    """Raised when the requested member or day is not in the family's plan."""
+
+
+def slice_plan_index(index, email=None, day=None, meal=None):
+    """Builds a {email: [day entries]} slice of a plan index, filtered by email, day and meal."""
+    emails = [email] if email is not None else list(index)
+    content = {}
+    for member_email in emails:
+        member_index = index.get(member_email)
+        if member_index is None:
+            raise SliceNotFound(f"No meal plan for {member_email}.")
+        days = [str(day)] if day is not None else sorted(member_index, key=int)
+        entries = []
+        for member_day in days:
+            meals = member_index.get(member_day)
+            if meals is None:
+                raise SliceNotFound(f"No meal plan for day {member_day}.")
+            day_entry = {"day": int(member_day)}
+            day_entry.update({name: meals.get(name) for name in ([meal] if meal else MEALS)})
+            entries.append(day_entry)
+        content[member_email] = entries
+    return content
+
+
+class CachedResponse:
+    """Pre-serialized /get-meal-plan body with its gzip variant and ETag."""
+
+    def __init__(self, content):
+        self.body = json.dumps(content, separators=(',', ':')).encode('utf-8')
+        self.gzip_body = gzip.compress(self.body, compresslevel=6)
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+
+
+class _FamilyEntry:
+    def __init__(self, signature, meal_plan, index):
+        self.signature = signature
+        self.meal_plan = meal_plan
+        self.index = index
+        self.slices = {}
+
+
+# In-process cache of ready-to-send meal plan responses, invalidated by file mtime or save hooks
+class MealPlanResponseCache:
+    def __init__(self, base_folder="meal_plans", max_entries=2048):
+        self.base_folder = base_folder
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def invalidate(self, family_id, file_path=None):
+        """Drops a family's cached responses; usable as a MealPlanSaver save listener.
+
+        Saves of other files (partial.json while streaming) leave the entry alone,
+        only 1.json is served from here.
+        """
+        if file_path is not None and os.path.basename(file_path) != '1.json':
+            return
+        with self._lock:
+            self._entries.pop(family_id, None)
+
+    def _load(self, family_id, signature, plan_path):
+        with open(plan_path, 'r') as file:
+            meal_plan = canonical_meal_plan(json.load(file))
+
+        # Prefer the index written at save time; older plans get one built here
+        index = None
+        index_path = os.path.join(self.base_folder, family_id, 'index.json')
+        try:
+            if os.stat(index_path).st_mtime_ns >= signature[0]:
+                with open(index_path, 'r') as file:
+                    index = json.load(file)["members"]
+        except (OSError, ValueError, KeyError):
+            index = None
+        if index is None:
+            index = build_plan_index(meal_plan)
+        return _FamilyEntry(signature, meal_plan, index)
+
+    def _family_entry(self, family_id):
+        plan_path = os.path.join(self.base_folder, family_id, '1.json')
+        try:
+            stat = os.stat(plan_path)
+        except FileNotFoundError:
+            self.invalidate(family_id)
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(family_id)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(family_id)
+                return entry
+
+        entry = self._load(family_id, signature, plan_path)
+        with self._lock:
+            self._entries[family_id] = entry
+            self._entries.move_to_end(family_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, family_id, email=None, day=None, meal=None):
+        """Returns the CachedResponse for a family's plan, or a slice of it, or None if it has no plan.
+
+        Slices keep the {email: [day entries]} shape, filtered by email, day and meal.
+        """
+        entry = self._family_entry(family_id)
+        if entry is None:
+            return None
+
+        key = (email, None if day is None else str(day), meal)
+        response = entry.slices.get(key)
+        if response is None:
+            if key == (None, None, None):
+                content = entry.meal_plan
+            else:
+                content = slice_plan_index(entry.index, *key)
+            response = CachedResponse(content)
+            entry.slices[key] = response
+        return response
@@ -0,0 +1,237 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import schedule
+
+
+class SchedulerStore:
+    """Leases and completed-work records shared by every process that can run scheduled jobs.
+
+    Backed by one SQLite file, so all workers on a host (or on nodes sharing the
+    volume) agree on who leads and what is already done.
+    """
+
+    def __init__(self, path='data/scheduler.db'):
+        self.path = path
+        self._local = threading.local()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY,"
+            " holder TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS completed ("
+            " job TEXT NOT NULL,"
+            " period TEXT NOT NULL,"
+            " item TEXT NOT NULL,"
+            " completed_at REAL NOT NULL,"
+            " PRIMARY KEY (job, period, item))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " job TEXT NOT NULL,"
+            " period TEXT NOT NULL,"
+            " started_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " PRIMARY KEY (job, period))"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    # Leases
+
+    def acquire_lease(self, name, holder, ttl):
+        """Takes or renews a lease; True if `holder` owns it for the next `ttl` seconds."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?",
+                               (name,)).fetchone()
+            acquired = row is None or row[0] == holder or row[1] < now
+            if acquired:
+                conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                             (name, holder, now + ttl))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return acquired
+
+    def release_lease(self, name, holder):
+        self._connection().execute("DELETE FROM leases WHERE name = ? AND holder = ?",
+                                   (name, holder))
+
+    def lease_holder(self, name):
+        row = self._connection().execute(
+            "SELECT holder FROM leases WHERE name = ? AND expires_at >= ?",
+            (name, time.time())).fetchone()
+        return row[0] if row else None
+
+    # Idempotency records
+
+    def is_done(self, job, period, item):
+        return self._connection().execute(
+            "SELECT 1 FROM completed WHERE job = ? AND period = ? AND item = ?",
+            (job, period, item)).fetchone() is not None
+
+    def mark_done(self, job, period, item):
+        self._connection().execute(
+            "INSERT OR IGNORE INTO completed VALUES (?, ?, ?, ?)", (job, period, item, time.time()))
+
+    def count_done(self, job, period):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM completed WHERE job = ? AND period = ?",
+            (job, period)).fetchone()[0]
+
+    def ledger(self, job, period):
+        """Per-(job, period) view with the is_done/mark_done interface RegenerationEngine expects."""
+        return Ledger(self, job, period)
+
+    def start_run(self, job, period):
+        self._connection().execute(
+            "INSERT OR IGNORE INTO runs (job, period, started_at) VALUES (?, ?, ?)",
+            (job, period, time.time()))
+
+    def finish_run(self, job, period):
+        self._connection().execute(
+            "UPDATE runs SET finished_at = ? WHERE job = ? AND period = ?",
+            (time.time(), job, period))
+
+    def run_status(self, job, period):
+        """Returns None if the run never started, else "running" or "finished"."""
+        row = self._connection().execute(
+            "SELECT finished_at FROM runs WHERE job = ? AND period = ?", (job, period)).fetchone()
+        if row is None:
+            return None
+        return "running" if row[0] is None else "finished"
+
+
+class Ledger:
+    """Items of one (job, period) that are already done; each item is processed at most once."""
+
+    def __init__(self, store, job, period):
+        self.store = store
+        self.job = job
+        self.period = period
+
+    def is_done(self, item):
+        return self.store.is_done(self.job, self.period, item)
+
+    def mark_done(self, item):
+        self.store.mark_done(self.job, self.period, item)
+
+    def __len__(self):
+        return self.store.count_done(self.job, self.period)
+
+
+def default_holder_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# Runs `schedule` jobs in whichever process holds the scheduler lease; the others stand by
+class LeaderScheduler:
+    def __init__(self, store, lease_name='scheduler', ttl=60, holder=None, poll_interval=1.0):
+        self.store = store
+        self.lease_name = lease_name
+        self.ttl = ttl
+        self.holder = holder or default_holder_id()
+        self.poll_interval = poll_interval
+        self.jobs = schedule.Scheduler()
+        self._on_elected = []
+        self._leader = threading.Event()
+        self._elected = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    @property
+    def is_leader(self):
+        return self._leader.is_set()
+
+    def leader_only(self, job_func):
+        """Wraps a job for self.jobs so it runs only while this process holds the lease:
+
+            scheduler.jobs.every().sunday.at("00:00").do(scheduler.leader_only(update_meal_plan))
+        """
+        def run_if_leader():
+            if self.is_leader:
+                self._run_safely(job_func)
+        return run_if_leader
+
+    def on_elected(self, callback):
+        """Registers callback(), run on the scheduler thread each time this process becomes leader."""
+        self._on_elected.append(callback)
+
+    def _heartbeat(self):
+        # Renew well before expiry so a healthy leader never loses the lease
+        while not self._stopping.is_set():
+            try:
+                leader = self.store.acquire_lease(self.lease_name, self.holder, self.ttl)
+            except sqlite3.Error as e:
+                logging.error(f"Scheduler lease check failed: {e}")
+                leader = False
+            if leader and not self._leader.is_set():
+                print(f"Scheduler: {self.holder} is now the leader")
+                self._elected.set()
+            elif not leader and self._leader.is_set():
+                print(f"Scheduler: {self.holder} lost the leader lease")
+            if leader:
+                self._leader.set()
+            else:
+                self._leader.clear()
+            self._stopping.wait(self.ttl / 3)
+
+    def _run_pending(self):
+        while not self._stopping.is_set():
+            if self._elected.is_set():
+                self._elected.clear()
+                for callback in self._on_elected:
+                    self._run_safely(callback)
+            # Followers tick too, so due jobs are skipped instead of piling up until they lead
+            self.jobs.run_pending()
+            self._stopping.wait(self.poll_interval)
+
+    @staticmethod
+    def _run_safely(callback):
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Scheduled job failed: {e}")
+            logging.error(traceback.format_exc())
+
+    def start(self):
+        """Starts the lease heartbeat and job threads; call once, from the process that should schedule."""
+        if self._threads:
+            return
+        for target, name in ((self._heartbeat, "scheduler-lease"), (self._run_pending, "scheduler")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        if self._leader.is_set():
+            self.store.release_lease(self.lease_name, self.holder)
+            self._leader.clear()
+        self._stopping.clear()
+
@@ -0,0 +1,139 @@
+import asyncio
+import socket
+import threading
+import time
+from email.mime.text import MIMEText
+
+import pytest
+
+from mailer import FAILED, SENT, AsyncOutbox, Outbox, SMTPConfig
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+
+class SinkHandler:
+    """aiosmtpd handler that answers DATA from a script of replies, then accepts everything."""
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.received = []
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, _server, _session, envelope):
+        with self._lock:
+            reply = self.replies.pop(0) if self.replies else "250 OK"
+            if reply.startswith("250"):
+                self.received.append(envelope)
+        return reply
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_sink():
+    started = []
+
+    def start(replies=()):
+        handler = SinkHandler(replies)
+        port = free_port()
+        controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        started.append(controller)
+        config = SMTPConfig(host="127.0.0.1", port=port, username="", password="", starttls=False)
+        return handler, config
+
+    yield start
+    for controller in started:
+        controller.stop()
+
+
+def message(recipient="member@example.com"):
+    msg = MIMEText("Your meal plan is ready.")
+    msg["From"] = "planner@example.com"
+    msg["To"] = recipient
+    msg["Subject"] = "Meal plan"
+    return msg
+
+
+def wait_for(outbox, message_id, status, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if outbox.status(message_id)["status"] == status:
+            return outbox.status(message_id)
+        time.sleep(0.02)
+    raise AssertionError(f"{message_id} is {outbox.status(message_id)}, expected {status}")
+
+
+def test_sends_batch_through_sink(smtp_sink):
+    handler, config = smtp_sink()
+    outbox = Outbox(config, pool_size=1, workers=1)
+
+    message_ids = outbox.send_batch([message(f"m{i}@example.com") for i in range(3)])
+
+    for message_id in message_ids:
+        assert wait_for(outbox, message_id, SENT)["attempts"] == 1
+    assert sorted(envelope.rcpt_tos[0] for envelope in handler.received) == [
+        "m0@example.com", "m1@example.com", "m2@example.com"]
+
+
+def test_retries_temporary_failure(smtp_sink):
+    handler, config = smtp_sink(["451 Try again later"])
+    outbox = Outbox(config, pool_size=1, workers=1, backoff=0.01)
+
+    status = wait_for(outbox, outbox.send(message()), SENT)
+
+    assert status["attempts"] == 2
+    assert status["error"] is None
+    assert len(handler.received) == 1
+
+
+def test_marks_failed_after_max_attempts(smtp_sink):
+    handler, config = smtp_sink(["554 Rejected"] * 3)
+    outbox = Outbox(config, pool_size=1, workers=1, max_attempts=3, backoff=0.01)
+
+    status = wait_for(outbox, outbox.send(message()), FAILED)
+
+    assert status["attempts"] == 3
+    assert "Rejected" in status["error"]
+    assert handler.received == []
+    assert outbox.pending() == 0
+
+
+def test_unexpected_error_keeps_worker_and_connection_slot(smtp_sink):
+    handler, config = smtp_sink()
+    # One connection and one worker: a dead worker or a leaked slot would stall the next send
+    outbox = Outbox(config, pool_size=1, workers=1, max_attempts=2, backoff=0.01)
+
+    broken = outbox.send({"To": "broken@example.com"})
+    assert wait_for(outbox, broken, FAILED)["attempts"] == 2
+
+    wait_for(outbox, outbox.send(message()), SENT)
+    assert len(handler.received) == 1
+
+
+def test_async_outbox_retries_and_fails(smtp_sink):
+    pytest.importorskip("aiosmtplib")
+    handler, config = smtp_sink(["451 Try again later", "250 OK", "554 Rejected", "554 Rejected"])
+
+    async def scenario():
+        outbox = AsyncOutbox(config, pool_size=1, workers=1, max_attempts=2, backoff=0.01)
+        outbox.bind(asyncio.get_running_loop())
+        retried = outbox.send(message("retried@example.com"))
+        while outbox.status(retried)["status"] != SENT:
+            await asyncio.sleep(0.02)
+        failed = outbox.send(message("failed@example.com"))
+        while outbox.status(failed)["status"] != FAILED:
+            await asyncio.sleep(0.02)
+        await outbox.aclose()
+        return outbox.status(retried), outbox.status(failed)
+
+    retried, failed = asyncio.run(asyncio.wait_for(scenario(), 10))
+
+    assert retried["attempts"] == 2
+    assert failed["attempts"] == 2
+    assert "Rejected" in failed["error"]
+    assert [envelope.rcpt_tos[0] for envelope in handler.received] == ["retried@example.com"]